@@ -1,11 +1,29 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, stream_with_context
 from flask_cors import CORS
-from price_service import get_current_price, validate_ticker
-from calculations import calculate_net_worth
-from models import User, Income, Asset, FilingStatus, USState, IncomeType, Debt, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency, HourlyType
-from firestore_db import get_user_data, save_user_data, get_db
-from auth import token_required
+from response_encoding import negotiate_response
+from profiling import install_profiler, is_admin
+from price_service import get_current_price, get_prices, validate_tickers, get_price_service_metrics
+from calculations import calculate_net_worth, calculate_balance_sheet, annual_insurance_cost, gross_income_for_year, traditional_retirement_deductions, compare_state_taxes
+from tax_logic import optimize_retirement_contributions
+from portfolio import market_tickers, summarize_portfolio
+from portfolio_schema import parse_portfolio_payload, PortfolioValidationError
+from models import FilingStatus, USState, IncomeType, AssetType, TaxLot
+from firestore_db import get_tax_lots, save_tax_lots, get_request_profile, record_audit_event, find_household, find_household_by_invite, save_household, add_household_member, remove_household_member
+from repository import get_user_data, get_users_data, get_user_profile, save_user_data, save_user_profile, list_user_items
+from auth import token_required, has_support_claim
+from transactions import import_transactions, TransactionImportError
+from export import export_user_data, NDJSON_MIMETYPE
+from household import HouseholdError, MAX_HOUSEHOLD_MEMBERS, parse_tax_profile, new_household, household_user, household_to_dict, merge_portfolios
+from tax_lots import LotIndex, TaxLotError, SALE_METHODS, SPECIFIC_ID, FIFO
+from tax_logic import calculate_capital_gains_tax
+import io
+import logging
+import time
 import uuid
+from datetime import date
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True, resources={r"/api/*": {
@@ -13,9 +31,17 @@ CORS(app, supports_credentials=True, resources={r"/api/*": {
     "allow_headers": ["Authorization", "Content-Type"],
     "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
 }})
+# Registered first so its after_request hook runs last and the profile covers response encoding
+install_profiler(app)
+app.after_request(negotiate_response)
 
-def asset_to_dict(asset):
-    current_price = get_current_price(asset.ticker) if asset.asset_type not in [AssetType.CASH, AssetType.HOUSING, AssetType.SAVINGS, AssetType.CHECKING, AssetType.HIGH_YIELD_SAVINGS] else 1.0
+def asset_to_dict(asset, prices=None):
+    if asset.asset_type in [AssetType.CASH, AssetType.HOUSING, AssetType.SAVINGS, AssetType.CHECKING, AssetType.HIGH_YIELD_SAVINGS]:
+        current_price = 1.0
+    elif prices is not None:
+        current_price = prices.get(asset.ticker)
+    else:
+        current_price = get_current_price(asset.ticker)
     return {
         'ticker': asset.ticker,
         'shares': asset.shares,
@@ -63,6 +89,26 @@ def insurance_to_dict(ins):
         'frequency': ins.frequency.name
     }
 
+def build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances, prices=None, include_tax_profile=True, earners=None):
+    """
+    Computes net worth and serializes the full portfolio for a response body.
+    Each distinct ticker is priced once (unless `prices` is given) and shared by
+    every computation below.
+    """
+    if prices is None:
+        prices = get_prices(market_tickers(assets))
+    net_worth_data = calculate_net_worth(user, incomes, assets, debts, retirement_accounts, insurances, prices=prices, earners=earners)
+    net_worth_data['assets'] = [asset_to_dict(a, prices) for a in assets]
+    net_worth_data['incomes'] = [income_to_dict(i) for i in incomes]
+    net_worth_data['debts'] = [debt_to_dict(d) for d in debts]
+    net_worth_data['retirement_accounts'] = [retirement_account_to_dict(ra) for ra in retirement_accounts]
+    net_worth_data['insurances'] = [insurance_to_dict(ins) for ins in insurances]
+    net_worth_data['portfolio_breakdown'] = summarize_portfolio(assets, retirement_accounts, prices)
+    if include_tax_profile:
+        net_worth_data['filing_status'] = user.filing_status.name
+        net_worth_data['state'] = user.state.name
+    return net_worth_data
+
 @app.route('/api/net_worth', methods=['GET'])
 @token_required
 def get_net_worth():
@@ -72,151 +118,51 @@ def get_net_worth():
     else:
         user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id=request.uid)
     
-    net_worth_data = calculate_net_worth(user, incomes, assets, debts, retirement_accounts, insurances)
-    net_worth_data['assets'] = [asset_to_dict(a) for a in assets]
-    net_worth_data['incomes'] = [income_to_dict(i) for i in incomes]
-    net_worth_data['debts'] = [debt_to_dict(d) for d in debts]
-    net_worth_data['retirement_accounts'] = [retirement_account_to_dict(ra) for ra in retirement_accounts]
-    net_worth_data['insurances'] = [insurance_to_dict(ins) for ins in insurances]
-    net_worth_data['filing_status'] = user.filing_status.name
-    net_worth_data['state'] = user.state.name
-    return jsonify(net_worth_data)
+    return jsonify(build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances))
 
 @app.route('/api/portfolio', methods=['PUT'])
 @token_required
 def update_portfolio():
     """Updates the portfolio with validation for tickers and numbers."""
     data = request.get_json()
-    if request.uid == "guest":
-        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id="demo_user")
-    else:
-        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id=request.uid)
-
-    # Update retirement accounts
-    new_retirement_data = data.get('retirement_accounts', [])
-    retirement_accounts = []
-    for ra_data in new_retirement_data:
-        ra_id = ra_data.get('id')
-        if not ra_id:
-            ra_id = str(uuid.uuid4())
-            
-        retirement_accounts.append(RetirementAccount(
-            id=ra_id,
-            name=ra_data['name'],
-            account_type=AccountType[ra_data['account_type']],
-            contributions_2025=float(ra_data.get('contributions_2025', 0)),
-            contributions_2026=float(ra_data.get('contributions_2026', 0))
-        ))
+    # An invalid payload is rejected before any storage read
+    try:
+        retirement_accounts, insurances, assets, incomes, debts = parse_portfolio_payload(data)
+    except PortfolioValidationError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
 
-    # Update insurances
-    new_insurance_data = data.get('insurances', [])
-    insurances = []
-    for ins_data in new_insurance_data:
-        insurances.append(Insurance(
-            name=ins_data['name'],
-            amount=float(ins_data.get('amount', 0)),
-            frequency=InsuranceFrequency[ins_data['frequency']]
-        ))
+    # The payload replaces every item, so only the filing status and state are read
+    user, _, _ = get_user_profile(user_id="demo_user" if request.uid == "guest" else request.uid)
 
-    # Update assets
-    new_assets_data = data.get('assets', [])
-    temp_assets = []
-    for asset_data in new_assets_data:
-        ticker = asset_data.get('ticker', '').upper()
-        asset_type_str = asset_data.get('asset_type', 'STOCK')
-        asset_type = AssetType[asset_type_str]
-        shares = float(asset_data.get('shares', 0))
-        cost_basis = float(asset_data.get('cost_basis', 0))
-
-        if shares < 0 or cost_basis < 0:
-             return jsonify({'error': f"Values for {ticker or asset_type_str} must be positive."}), 400
-
-        if asset_type in [AssetType.STOCK, AssetType.BOND]:
-            if not ticker:
-                 return jsonify({'error': "Ticker is required for stocks and bonds."}), 400
-            if not validate_ticker(ticker):
-                 return jsonify({'error': f"Invalid ticker: {ticker}. Please enter a real market symbol."}), 400
-        elif asset_type in [AssetType.CASH, AssetType.SAVINGS, AssetType.CHECKING, AssetType.HIGH_YIELD_SAVINGS]:
-            ticker = asset_type.name
-            cost_basis = 1.0
-        elif asset_type == AssetType.HOUSING:
-            if not ticker:
-                ticker = 'PRIMARY RESIDENCE'
-            cost_basis = shares 
-
-        asset = Asset(
-            ticker=ticker,
-            shares=shares,
-            cost_basis=cost_basis,
-            asset_type=asset_type
-        )
-        if 'retirement_account_id' in asset_data:
-            asset.retirement_account_id = asset_data['retirement_account_id']
-        temp_assets.append(asset)
-    
-    assets = temp_assets
-
-    # Update incomes
-    new_incomes_data = data.get('incomes', [])
-    incomes = []
-    for income_data in new_incomes_data:
-        income_type = IncomeType[income_data['income_type']]
-        amount = 0
-        income = Income(income_type=income_type)
-        income.year = int(income_data.get('year', 2026))
-
-        if income_type == IncomeType.ANNUAL_SALARY:
-            amount = float(income_data.get('yearly_income', 0))
-            income.monthly_income = amount / 12
-        elif income_type == IncomeType.MONTHLY_SALARY:
-            income.monthly_income = float(income_data.get('monthly_income', 0))
-            amount = income.monthly_income * 12
-        elif income_type == IncomeType.HOURLY:
-            hourly_wage = float(income_data.get('hourly_wage', 0))
-            hours_worked = float(income_data.get('hours_worked', 0))
-            income.hourly_type = HourlyType[income_data.get('hourly_type', 'REPEATING')]
-            
-            if income.hourly_type == HourlyType.REPEATING:
-                amount = hourly_wage * hours_worked * 52
-            else: # ONE_TIME
-                amount = hourly_wage * hours_worked
-                
-            income.hourly_wage = hourly_wage
-            income.hours_worked = hours_worked
-            
-        income.amount = max(0, amount)
-        incomes.append(income)
-
-    # Update debts
-    new_debts_data = data.get('debts', [])
-    debts = []
-    for debt_data in new_debts_data:
-        initial = float(debt_data.get('initial_amount', 0))
-        paid = float(debt_data.get('amount_paid', 0))
-        if initial < 0 or paid < 0:
-             return jsonify({'error': "Debt amounts must be positive."}), 400
-        
-        debts.append(
-            Debt(
-                name=debt_data['name'] or 'Unnamed Debt',
-                initial_amount=initial,
-                amount_paid=paid,
-                monthly_payment=float(debt_data.get('monthly_payment', 0)),
-                interest_rate=float(debt_data.get('interest_rate', 0))
-            )
-        )
+    # Only a structurally valid payload reaches the upstream: each distinct ticker is priced once,
+    # and the same quotes serve validation and the response
+    prices, invalid_tickers = validate_tickers(market_tickers(assets))
+    if invalid_tickers:
+        errors = [{'field': 'assets', 'message': f"Invalid ticker: {ticker}. Please enter a real market symbol."} for ticker in invalid_tickers]
+        return jsonify({'error': errors[0]['message'], 'errors': errors}), 400
 
     # Save to Firestore only for registered users
     if request.uid != "guest":
         save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id=request.uid)
 
-    net_worth_data = calculate_net_worth(user, incomes, assets, debts, retirement_accounts, insurances)
-    net_worth_data['assets'] = [asset_to_dict(a) for a in assets]
-    net_worth_data['incomes'] = [income_to_dict(i) for i in incomes]
-    net_worth_data['debts'] = [debt_to_dict(d) for d in debts]
-    net_worth_data['retirement_accounts'] = [retirement_account_to_dict(ra) for ra in retirement_accounts]
-    net_worth_data['insurances'] = [insurance_to_dict(ins) for ins in insurances]
-    return jsonify(net_worth_data)
+    return jsonify(build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances, prices=prices, include_tax_profile=False))
+
+def apply_tax_info(user, data):
+    """Applies the filing_status and state of a PUT /api/user_tax_info body to user. Raises ValueError."""
+    new_filing_status_str = data.get('filing_status')
+    new_state_str = data.get('state')
+
+    if new_filing_status_str:
+        try:
+            user.filing_status = FilingStatus[new_filing_status_str]
+        except KeyError:
+            raise ValueError(f"Invalid filing status: {new_filing_status_str}")
+
+    if new_state_str:
+        try:
+            user.state = USState[new_state_str]
+        except KeyError:
+            raise ValueError(f"Invalid state: {new_state_str}")
 
 @app.route('/api/user_tax_info', methods=['PUT'])
 @token_required
@@ -227,34 +173,409 @@ def update_user_tax_info():
     else:
         user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id=request.uid)
     
-    new_filing_status_str = data.get('filing_status')
-    new_state_str = data.get('state')
+    try:
+        apply_tax_info(user, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    if new_filing_status_str:
+    # Save to Firestore only for registered users; the items are unchanged
+    if request.uid != "guest":
+        save_user_profile(user, user_id=request.uid)
+
+    return jsonify(build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances))
+
+@app.route('/api/retirement_optimizer', methods=['POST'])
+@token_required
+def optimize_retirement():
+    """
+    Returns the Traditional/Roth contribution split that minimizes combined tax.
+    Reads the user's 2026 income and insurance; does not fetch prices or write.
+    """
+    data = request.get_json(silent=True) or {}
+    if request.uid == "guest":
+        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id="demo_user")
+    else:
+        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id=request.uid)
+
+    try:
+        contribution = float(data.get('contribution', sum(ra.contributions_2026 for ra in retirement_accounts)))
+        retirement_income = float(data.get('retirement_income', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': "Contribution and retirement income must be numbers."}), 400
+    if contribution < 0 or retirement_income < 0:
+        return jsonify({'error': "Contribution and retirement income must be positive."}), 400
+
+    retirement_state = user.state
+    if data.get('retirement_state'):
         try:
-            user.filing_status = FilingStatus[new_filing_status_str]
+            retirement_state = USState[data['retirement_state']]
         except KeyError:
-            return jsonify({'error': f"Invalid filing status: {new_filing_status_str}"}), 400
-    
-    if new_state_str:
+            return jsonify({'error': f"Invalid state: {data['retirement_state']}"}), 400
+
+    gross_income = gross_income_for_year(incomes, 2026)
+    insurance_deductions = annual_insurance_cost(insurances)
+    filing_statuses = list(FilingStatus) if data.get('all_filing_statuses') else [user.filing_status]
+
+    results = {}
+    for filing_status in filing_statuses:
+        results[filing_status.name] = optimize_retirement_contributions(
+            gross_income,
+            contribution,
+            filing_status=filing_status.value,
+            state=user.state.name,
+            other_deductions=insurance_deductions,
+            retirement_income=retirement_income,
+            retirement_state=retirement_state.name
+        )
+
+    return jsonify({
+        'gross_income': gross_income,
+        'filing_status': user.filing_status.name,
+        'state': user.state.name,
+        'retirement_state': retirement_state.name,
+        'results': results
+    })
+
+@app.route('/api/state_comparison', methods=['GET'])
+@token_required
+def compare_states():
+    """
+    Ranks every state by the tax on the user's 2026 income and deductions.
+    Read-only: no prices are fetched and nothing is saved.
+    """
+    if request.uid == "guest":
+        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id="demo_user")
+    else:
+        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id=request.uid)
+
+    filing_status = user.filing_status
+    if request.args.get('filing_status'):
         try:
-            user.state = USState[new_state_str]
+            filing_status = FilingStatus[request.args['filing_status']]
         except KeyError:
-            return jsonify({'error': f"Invalid state: {new_state_str}"}), 400
-    
+            return jsonify({'error': f"Invalid filing status: {request.args['filing_status']}"}), 400
+
+    gross_income = gross_income_for_year(incomes, 2026)
+    deductions = traditional_retirement_deductions(retirement_accounts, 2026) + annual_insurance_cost(insurances)
+    taxable_income = max(0, gross_income - deductions)
+
+    return jsonify({
+        'gross_income': gross_income,
+        'taxable_income': taxable_income,
+        'filing_status': filing_status.name,
+        'current_state': user.state.name,
+        'states': compare_state_taxes(gross_income, taxable_income, filing_status.value)
+    })
+
+@app.route('/api/<any(assets, incomes, debts):collection>', methods=['GET'])
+@token_required
+def list_items(collection):
+    """
+    Returns one page of the user's assets, incomes or debts: ?limit=&cursor=.
+    Pass the returned next_cursor to get the following page; it is null on the last one.
+    Only the tickers on an assets page are priced.
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': "Limit must be a number."}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': f"Limit must be between 1 and {MAX_PAGE_SIZE}."}), 400
+    cursor = request.args.get('cursor') or None
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({'error': f"Invalid cursor: {cursor}"}), 400
+
+    user_id = "demo_user" if request.uid == "guest" else request.uid
+    items, next_cursor = list_user_items(collection, user_id=user_id, limit=limit, cursor=cursor)
+
+    if collection == 'assets':
+        prices = get_prices(market_tickers(items))
+        items = [asset_to_dict(a, prices) for a in items]
+    elif collection == 'incomes':
+        items = [income_to_dict(i) for i in items]
+    else:
+        items = [debt_to_dict(d) for d in items]
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+def tax_lot_to_dict(lot):
+    return {
+        'id': lot.id,
+        'ticker': lot.ticker,
+        'shares': lot.shares,
+        'cost_basis': lot.cost_basis,
+        'acquired': lot.acquired.isoformat(),
+        'retirement_account_id': lot.retirement_account_id
+    }
+
+def normalize_ticker(value):
+    """Returns a ticker as stored on tax lots: stripped and upper-cased ('' if missing)."""
+    return str(value or '').upper().strip()
+
+def parse_tax_lots_payload(data):
+    """Builds TaxLot objects from a PUT /api/tax_lots body. Raises TaxLotError."""
+    lots = []
+    for lot_data in data.get('lots', []):
+        ticker = normalize_ticker(lot_data.get('ticker'))
+        if not ticker:
+            raise TaxLotError("Every lot needs a ticker.")
+        try:
+            shares = float(lot_data.get('shares'))
+            cost_basis = float(lot_data.get('cost_basis'))
+        except (TypeError, ValueError):
+            raise TaxLotError(f"Shares and cost basis must be numbers for lot of {ticker}.")
+        if shares <= 0 or cost_basis < 0:
+            raise TaxLotError(f"Lot of {ticker} needs positive shares and a non-negative cost basis.")
+        try:
+            acquired = date.fromisoformat(lot_data.get('acquired', ''))
+        except (TypeError, ValueError):
+            raise TaxLotError(f"Invalid acquisition date for lot of {ticker}: {lot_data.get('acquired')}")
+        lots.append(TaxLot(
+            id=lot_data.get('id') or str(uuid.uuid4()),
+            ticker=ticker,
+            shares=shares,
+            cost_basis=cost_basis,
+            acquired=acquired,
+            retirement_account_id=lot_data.get('retirement_account_id')
+        ))
+    return lots
+
+@app.route('/api/tax_lots', methods=['GET'])
+@token_required
+def list_tax_lots():
+    """Returns the user's tax lots, optionally for one ?ticker=, in acquisition order."""
+    user_id = "demo_user" if request.uid == "guest" else request.uid
+    lots = get_tax_lots(user_id=user_id, ticker=normalize_ticker(request.args.get('ticker')) or None)
+    lots.sort(key=lambda lot: (lot.ticker, lot.acquired))
+    return jsonify({'lots': [tax_lot_to_dict(lot) for lot in lots]})
+
+@app.route('/api/tax_lots', methods=['PUT'])
+@token_required
+def update_tax_lots():
+    """Replaces the user's tax lots. Lots without an id are assigned one."""
+    data = request.get_json(silent=True) or {}
+    try:
+        lots = parse_tax_lots_payload(data)
+    except TaxLotError as e:
+        return jsonify({'error': str(e)}), 400
+
     # Save to Firestore only for registered users
     if request.uid != "guest":
-        save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id=request.uid)
+        save_tax_lots(lots, user_id=request.uid)
+    return jsonify({'lots': [tax_lot_to_dict(lot) for lot in lots]})
 
-    net_worth_data = calculate_net_worth(user, incomes, assets, debts, retirement_accounts, insurances)
-    net_worth_data['assets'] = [asset_to_dict(a) for a in assets]
-    net_worth_data['incomes'] = [income_to_dict(i) for i in incomes]
-    net_worth_data['debts'] = [debt_to_dict(d) for d in debts]
-    net_worth_data['retirement_accounts'] = [retirement_account_to_dict(ra) for ra in retirement_accounts]
-    net_worth_data['insurances'] = [insurance_to_dict(ins) for ins in insurances]
-    net_worth_data['filing_status'] = user.filing_status.name
-    net_worth_data['state'] = user.state.name
+@app.route('/api/tax_lots/simulate_sale', methods=['POST'])
+@token_required
+def simulate_lot_sale():
+    """
+    Estimates the gain and tax of selling shares of one ticker under FIFO, LIFO,
+    HIFO or SPECIFIC_ID lot selection. Nothing is sold or saved. Tax is only
+    estimated for taxable lots (no retirement_account_id) and stacks the gains
+    on the user's 2026 income.
+    """
+    data = request.get_json(silent=True) or {}
+    ticker = normalize_ticker(data.get('ticker'))
+    method = data.get('method', FIFO)
+    if not ticker:
+        return jsonify({'error': "A ticker is required."}), 400
+    if method not in SALE_METHODS:
+        return jsonify({'error': f"Invalid sale method: {method}"}), 400
+
+    if request.uid == "guest":
+        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id="demo_user")
+        lots = get_tax_lots(user_id="demo_user", ticker=ticker)
+    else:
+        user, incomes, assets, debts, retirement_accounts, insurances = get_user_data(user_id=request.uid)
+        lots = get_tax_lots(user_id=request.uid, ticker=ticker)
+    try:
+        shares = float(data.get('shares', 0))
+        price = float(data['price']) if data.get('price') is not None else get_current_price(ticker)
+        sale_date = date.fromisoformat(data['sale_date']) if data.get('sale_date') else date.today()
+        selections = [(s['lot_id'], float(s['shares'])) for s in data.get('lots', [])] if method == SPECIFIC_ID else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': "Shares, price and lot selections must be numbers, and sale_date an ISO date."}), 400
+    if price is None:
+        return jsonify({'error': f"No price available for {ticker}."}), 400
+
+    account_id = data.get('retirement_account_id')
+    index = LotIndex([lot for lot in lots if lot.retirement_account_id == account_id])
+    try:
+        sale = index.simulate_sale(ticker, shares, price, sale_date, method, selections, include_lots=bool(data.get('include_lots')))
+    except TaxLotError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if account_id is None:
+        gross_income = gross_income_for_year(incomes, 2026)
+        deductions = traditional_retirement_deductions(retirement_accounts, 2026) + annual_insurance_cost(insurances)
+        sale['tax'] = calculate_capital_gains_tax(
+            max(0, gross_income - deductions),
+            sale['short_term']['gain'],
+            sale['long_term']['gain'],
+            filing_status=user.filing_status.value,
+            state=user.state.name
+        )
+    else:
+        sale['tax'] = None
+    return jsonify(sale)
+
+@app.route('/api/transactions/import', methods=['POST'])
+@token_required
+def import_bank_transactions():
+    """
+    Imports a CSV or OFX bank export, sent as a multipart 'file' field or as the raw body.
+    The upload is processed as a stream; only monthly aggregates are stored.
+    Guest imports are analyzed but not saved.
+    """
+    upload = request.files.get('file')
+    raw = upload.stream if upload else request.stream
+    filename = (upload.filename or '') if upload else ''
+    fmt = request.args.get('format') or ('ofx' if filename.lower().endswith(('.ofx', '.qfx')) else 'csv')
+    if fmt not in ['csv', 'ofx']:
+        return jsonify({'error': f"Unsupported format: {fmt}"}), 400
+
+    stream = io.TextIOWrapper(raw if upload else io.BufferedReader(raw), encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        summary = import_transactions(stream, fmt=fmt, user_id=None if request.uid == "guest" else request.uid)
+    except TransactionImportError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(summary)
+
+@app.route('/api/household', methods=['GET'])
+@token_required
+def get_household_net_worth():
+    """
+    Returns the combined net worth and joint tax of the user's household, plus each member's net worth.
+    All members' data is fetched in one batch and every distinct ticker is priced once.
+    """
+    if request.uid == "guest":
+        return jsonify({'error': "Sign in to use households."}), 403
+    household_id, household = find_household(request.uid)
+    if household is None:
+        return jsonify({'error': "You are not in a household."}), 404
+
+    members = household['members']
+    portfolios = get_users_data(members)
+    incomes, assets, debts, retirement_accounts, insurances, earners = merge_portfolios([portfolios[uid] for uid in members])
+    prices = get_prices(market_tickers(assets))
+    net_worth_data = build_net_worth_response(household_user(household), incomes, assets, debts, retirement_accounts, insurances, prices=prices, earners=earners)
+    net_worth_data['household'] = household_to_dict(household_id, household)
+    net_worth_data['members'] = []
+    for uid in members:
+        _, _, member_assets, member_debts, _, _ = portfolios[uid]
+        # Members are taxed jointly, so only their balances are computed apart
+        net_worth_data['members'].append(dict(calculate_balance_sheet(member_assets, member_debts, prices=prices), uid=uid))
     return jsonify(net_worth_data)
 
+@app.route('/api/household', methods=['POST'])
+@token_required
+def create_household():
+    """
+    Creates a household with the user as its first member. The filing status defaults to
+    MARRIED_FILING_JOINTLY and the state to the user's own. Share the returned invite_code to add members.
+    """
+    if request.uid == "guest":
+        return jsonify({'error': "Sign in to use households."}), 403
+    if find_household(request.uid)[1] is not None:
+        return jsonify({'error': "You are already in a household."}), 400
+    user, _, _ = get_user_profile(user_id=request.uid)
+    try:
+        filing_status, state = parse_tax_profile(request.get_json(silent=True) or {}, user.state)
+    except HouseholdError as e:
+        return jsonify({'error': str(e)}), 400
+    household_id = str(uuid.uuid4())
+    household = new_household(request.uid, filing_status, state)
+    save_household(household_id, household)
+    return jsonify(household_to_dict(household_id, household))
+
+@app.route('/api/household/join', methods=['POST'])
+@token_required
+def join_household():
+    """Joins the household an invite_code belongs to."""
+    if request.uid == "guest":
+        return jsonify({'error': "Sign in to use households."}), 403
+    invite_code = (request.get_json(silent=True) or {}).get('invite_code')
+    if not invite_code:
+        return jsonify({'error': "An invite code is required."}), 400
+    if find_household(request.uid)[1] is not None:
+        return jsonify({'error': "You are already in a household."}), 400
+    household_id, household = find_household_by_invite(invite_code)
+    if household is None:
+        return jsonify({'error': "Invalid invite code."}), 404
+    # The member count is checked again in the same transaction as the write
+    household = add_household_member(household_id, request.uid, MAX_HOUSEHOLD_MEMBERS)
+    if household is None:
+        return jsonify({'error': "Invalid invite code."}), 404
+    if request.uid not in household['members']:
+        return jsonify({'error': f"A household can have at most {MAX_HOUSEHOLD_MEMBERS} members."}), 400
+    return jsonify(household_to_dict(household_id, household))
+
+@app.route('/api/household/leave', methods=['POST'])
+@token_required
+def leave_household():
+    """Leaves the user's household. An owner who leaves hands it to the longest-standing member; the last member deletes it."""
+    if request.uid == "guest":
+        return jsonify({'error': "Sign in to use households."}), 403
+    household_id, household = find_household(request.uid)
+    if household is None:
+        return jsonify({'error': "You are not in a household."}), 404
+    remove_household_member(household_id, request.uid)
+    return jsonify({'left': household_id})
+
+def export_response(user_id):
+    return app.response_class(
+        stream_with_context(export_user_data(user_id)),
+        mimetype=NDJSON_MIMETYPE,
+        headers={'Content-Disposition': f'attachment; filename="pfa-export-{date.today().isoformat()}.ndjson"'}
+    )
+
+@app.route('/api/export', methods=['GET'])
+@token_required
+def export_data():
+    """
+    Streams all of the user's stored data as newline-delimited JSON (see export.py).
+    Nothing is priced, and the response starts before the first read.
+    """
+    user_id = "demo_user" if request.uid == "guest" else request.uid
+    return export_response(user_id)
+
+@app.route('/api/admin/export/<user_id>', methods=['GET'])
+@token_required
+def export_user(user_id):
+    """
+    Streams any user's export for support. Requires a signed-in user whose token
+    carries the support custom claim; every export is recorded in the audit log
+    before any data is read.
+    """
+    if request.uid == "guest" or not has_support_claim():
+        return jsonify({'error': "Support access required."}), 403
+    event = {'action': 'admin_export', 'actor': request.uid, 'user_id': user_id, 'at': time.time(), 'ip': request.remote_addr}
+    try:
+        record_audit_event(event)
+    except Exception as e:
+        # Never hand out data the audit log does not show
+        logging.error(f"Failed to record admin export of {user_id} by {request.uid}: {e}")
+        return jsonify({'error': "Could not record the export; try again."}), 503
+    logging.info(f"Admin export of user {user_id} by {request.uid}")
+    return export_response(user_id)
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Returns a stored request profile by the X-Profile-Id its response carried. Requires the X-Profile-Token admin header."""
+    if not is_admin(request.headers.get('X-Profile-Token')):
+        return jsonify({'error': "Admin token required."}), 403
+    record = get_request_profile(profile_id)
+    if record is None:
+        return jsonify({'error': f"No profile {profile_id}"}), 404
+    if request.args.get('raw'):
+        mimetype = 'application/json' if record['format'] == 'speedscope' else 'text/plain'
+        return app.response_class(record['profile'], mimetype=mimetype)
+    return jsonify(record)
+
+@app.route('/api/metrics/price_service', methods=['GET'])
+def price_service_metrics():
+    """Exposes the quote upstream's circuit breaker state and call counters for this instance. Requires the X-Profile-Token admin header."""
+    if not is_admin(request.headers.get('X-Profile-Token')):
+        return jsonify({'error': "Admin token required."}), 403
+    return jsonify(get_price_service_metrics())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
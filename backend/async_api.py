@@ -0,0 +1,152 @@
+"""
+Async variant of the API in api.py.
+
+Only the dashboard routes have async views here: GET /api/net_worth,
+PUT /api/portfolio and PUT /api/user_tax_info. They keep the same response
+schema and check the token before the payload, like the sync app, but run
+blocking I/O off the event loop and overlap what can be overlapped: all quotes
+are fetched concurrently, and the Firestore write on PUT runs while the
+response is being computed. Every
+other route is registered from api.py unchanged, so both apps serve the same
+URLs. The request profiler is only installed on the sync app.
+"""
+import asyncio
+from flask import Flask, jsonify, request
+from flask_cors import CORS
+from response_encoding import negotiate_response
+from firebase_admin import auth
+from price_service import get_current_price, get_quote, UNAVAILABLE
+from portfolio import market_tickers
+from firestore_db import get_db
+from repository import get_user_data, get_user_profile, save_user_data, save_user_profile
+from auth import get_bearer_token
+import api
+from api import build_net_worth_response, apply_tax_info
+from portfolio_schema import parse_portfolio_payload, PortfolioValidationError
+
+app = Flask(__name__)
+CORS(app, supports_credentials=True, resources={r"/api/*": {
+    "origins": "*",
+    "allow_headers": ["Authorization", "Content-Type"],
+    "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+}})
+app.after_request(negotiate_response)
+
+class InvalidTokenError(Exception):
+    """Raised when a provided ID token fails verification."""
+
+async def verify_token(id_token):
+    try:
+        decoded_token = await asyncio.to_thread(auth.verify_id_token, id_token)
+    except Exception as e:
+        raise InvalidTokenError(str(e)) from e
+    return decoded_token['uid']
+
+async def authenticate():
+    """Resolves the caller's uid ("guest" without a token). Reads no user data."""
+    # Ensure Firebase is initialized
+    get_db()
+
+    id_token = get_bearer_token()
+    if not id_token:
+        return "guest"
+    return await verify_token(id_token)
+
+def data_user_id(uid):
+    return "demo_user" if uid == "guest" else uid
+
+async def authenticate_and_load():
+    """
+    Resolves the caller's uid and loads their data. Nothing is read for a
+    token until it has been verified. Returns (uid, user_data).
+    """
+    uid = await authenticate()
+    return uid, await asyncio.to_thread(get_user_data, user_id=data_user_id(uid))
+
+async def fetch_prices(tickers, lookup=get_current_price):
+    """Fetches quotes for all distinct tickers concurrently. Returns {ticker: price}."""
+    results = await asyncio.gather(*(asyncio.to_thread(lookup, t) for t in tickers))
+    return dict(zip(tickers, results))
+
+def invalid_token_response(e):
+    return jsonify({'message': 'Token is invalid!', 'error': str(e)}), 401
+
+@app.route('/api/net_worth', methods=['GET'])
+async def get_net_worth():
+    """Calculates and returns the current net worth."""
+    try:
+        uid, (user, incomes, assets, debts, retirement_accounts, insurances) = await authenticate_and_load()
+    except InvalidTokenError as e:
+        return invalid_token_response(e)
+
+    prices = await fetch_prices(market_tickers(assets))
+    return jsonify(build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances, prices=prices))
+
+@app.route('/api/portfolio', methods=['PUT'])
+async def update_portfolio():
+    """Updates the portfolio with validation for tickers and numbers."""
+    data = request.get_json()
+    try:
+        uid = await authenticate()
+    except InvalidTokenError as e:
+        return invalid_token_response(e)
+
+    # Parse without any I/O; tickers are validated below in one concurrent batch
+    try:
+        retirement_accounts, insurances, assets, incomes, debts = parse_portfolio_payload(data)
+    except PortfolioValidationError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+
+    # The payload replaces every item, so only the filing status and state are read
+    user, _, _ = await asyncio.to_thread(get_user_profile, user_id=data_user_id(uid))
+
+    # Validation is a price lookup, so the same quotes serve validation and the response.
+    # Only tickers the upstream reports as unknown are rejected; unverifiable ones are accepted
+    tickers = market_tickers(assets)
+    quotes = await fetch_prices(tickers, lookup=get_quote)
+    invalid_tickers = [ticker for ticker in tickers if quotes[ticker] is None]
+    prices = {ticker: None if price is UNAVAILABLE else price for ticker, price in quotes.items()}
+    if invalid_tickers:
+        errors = [{'field': 'assets', 'message': f"Invalid ticker: {ticker}. Please enter a real market symbol."} for ticker in invalid_tickers]
+        return jsonify({'error': errors[0]['message'], 'errors': errors}), 400
+
+    # Save to Firestore only for registered users, overlapping with the response computation
+    save = None
+    if uid != "guest":
+        save = asyncio.ensure_future(asyncio.to_thread(save_user_data, user, incomes, assets, debts, retirement_accounts, insurances, user_id=uid))
+
+    net_worth_data = build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances, prices=prices, include_tax_profile=False)
+    if save is not None:
+        await save
+    return jsonify(net_worth_data)
+
+@app.route('/api/user_tax_info', methods=['PUT'])
+async def update_user_tax_info():
+    data = request.get_json()
+    try:
+        uid, (user, incomes, assets, debts, retirement_accounts, insurances) = await authenticate_and_load()
+    except InvalidTokenError as e:
+        return invalid_token_response(e)
+
+    try:
+        apply_tax_info(user, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    save = None
+    if uid != "guest":
+        save = asyncio.ensure_future(asyncio.to_thread(save_user_profile, user, user_id=uid))
+
+    prices = await fetch_prices(market_tickers(assets))
+    net_worth_data = build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances, prices=prices)
+    if save is not None:
+        await save
+    return jsonify(net_worth_data)
+
+# Everything without an async view is served by the sync view from api.py
+for rule in api.app.url_map.iter_rules():
+    if rule.endpoint != 'static' and rule.endpoint not in app.view_functions:
+        app.add_url_rule(rule.rule, rule.endpoint, api.app.view_functions[rule.endpoint], methods=rule.methods)
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5001, debug=False)
@@ -3,6 +3,17 @@ from flask import request, jsonify
 from functools import wraps
 from firestore_db import get_db
 
+# Firebase custom claim that lets a signed-in user act on other users' data for support.
+# Granted out of band with auth.set_custom_user_claims(uid, {'support': True}).
+SUPPORT_CLAIM = 'support'
+
+def get_bearer_token():
+    """Returns the ID token from the Authorization header, or None."""
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split('Bearer ')[1]
+    return None
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -13,21 +24,19 @@ def token_required(f):
         if request.method == 'OPTIONS':
             return f(*args, **kwargs)
 
-        id_token = None
-        auth_header = request.headers.get('Authorization')
-        
-        if auth_header and auth_header.startswith('Bearer '):
-            id_token = auth_header.split('Bearer ')[1]
+        id_token = get_bearer_token()
         
         # If no token, we treat as a guest
         if not id_token:
             request.uid = "guest"
+            request.claims = {}
             return f(*args, **kwargs)
         
         try:
             # Verify the ID token
             decoded_token = auth.verify_id_token(id_token)
             request.uid = decoded_token['uid']
+            request.claims = decoded_token
         except Exception as e:
             # If token is provided but invalid, we reject it
             return jsonify({'message': 'Token is invalid!', 'error': str(e)}), 401
@@ -35,3 +44,7 @@ def token_required(f):
         return f(*args, **kwargs)
     
     return decorated
+
+def has_support_claim():
+    """True if the current request's verified ID token carries the support custom claim."""
+    return getattr(request, 'claims', {}).get(SUPPORT_CLAIM) is True
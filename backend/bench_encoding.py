@@ -0,0 +1,75 @@
+"""
+Benchmarks response encodings for net worth payloads of increasing size.
+
+Builds synthetic portfolios with build_net_worth_response (prices are
+supplied, so nothing is fetched) and times the path production takes for each
+encoding that response_encoding can negotiate: jsonify, then the
+negotiate_response hook (MessagePack re-encoding of the JSON body and
+compression) inside a request carrying the matching Accept and
+Accept-Encoding headers. Reports the body size and that time.
+
+Usage: python bench_encoding.py [sizes...]   e.g. python bench_encoding.py 10 100 1000
+"""
+import sys
+import time
+from flask import Flask, jsonify
+from api import build_net_worth_response
+from models import User, Income, Asset, Debt, FilingStatus, USState, IncomeType, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency, HourlyType
+from response_encoding import negotiate_response, msgpack, brotli, COMPRESSION_THRESHOLD, MSGPACK_MIMETYPE
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+REPEATS = 20
+
+def synthetic_portfolio(size):
+    """Returns net worth response data for a portfolio with `size` assets."""
+    user = User(filing_status=FilingStatus.MARRIED_FILING_JOINTLY, state=USState.CA)
+    retirement_accounts = [
+        RetirementAccount(id=f"ra-{i}", name=f"Account {i}", account_type=list(AccountType)[i % len(AccountType)], contributions_2025=6000.0, contributions_2026=7000.0)
+        for i in range(max(1, size // 100))
+    ]
+    assets = []
+    for i in range(size):
+        asset = Asset(ticker=f"TCK{i % 500}", shares=10.0 + i % 37, cost_basis=1000.0 + i, asset_type=AssetType.STOCK if i % 4 else AssetType.BOND)
+        asset.retirement_account_id = retirement_accounts[i % len(retirement_accounts)].id if i % 3 else None
+        assets.append(asset)
+    incomes = [
+        Income(income_type=IncomeType.ANNUAL_SALARY, hourly_type=HourlyType.REPEATING, amount=120000.0 + i, monthly_income=10000.0, year=2025 + i % 2)
+        for i in range(max(1, size // 50))
+    ]
+    debts = [Debt(name=f"Debt {i}", initial_amount=20000.0, amount_paid=1500.0 * i, monthly_payment=400.0, interest_rate=6.5) for i in range(max(1, size // 20))]
+    insurances = [Insurance(name="Health", amount=450.0, frequency=InsuranceFrequency.MONTHLY)]
+    prices = {f"TCK{i}": 20.0 + i * 0.37 for i in range(500)}
+    return build_net_worth_response(user, incomes, assets, debts, retirement_accounts, insurances, prices=prices)
+
+def encodings():
+    """Returns (name, Accept, Accept-Encoding) for each encoding the hook can produce."""
+    result = [('json', 'application/json', 'identity'), ('json+gzip', 'application/json', 'gzip')]
+    if brotli is not None:
+        result.append(('json+br', 'application/json', 'br'))
+    if msgpack is not None:
+        result.append(('msgpack', MSGPACK_MIMETYPE, 'identity'))
+        result.append(('msgpack+gzip', MSGPACK_MIMETYPE, 'gzip'))
+        if brotli is not None:
+            result.append(('msgpack+br', MSGPACK_MIMETYPE, 'br'))
+    return result
+
+def run(sizes):
+    app = Flask(__name__)
+    rows = []
+    for size in sizes:
+        data = synthetic_portfolio(size)
+        for name, accept, accept_encoding in encodings():
+            with app.test_request_context(headers={'Accept': accept, 'Accept-Encoding': accept_encoding}):
+                start = time.perf_counter()
+                for _ in range(REPEATS):
+                    body = negotiate_response(jsonify(data)).get_data()
+                elapsed_ms = (time.perf_counter() - start) / REPEATS * 1000
+            rows.append({'assets': size, 'encoding': name, 'bytes': len(body), 'encode_ms': round(elapsed_ms, 3)})
+    return rows
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"Compression threshold: {COMPRESSION_THRESHOLD} bytes")
+    print(f"{'assets':>7} {'encoding':<14} {'bytes':>10} {'encode_ms':>10}")
+    for row in run(sizes):
+        print(f"{row['assets']:>7} {row['encoding']:<14} {row['bytes']:>10} {row['encode_ms']:>10.3f}")
@@ -1,11 +1,66 @@
 from price_service import get_current_price
-from tax_logic import calculate_federal_tax, calculate_state_tax, calculate_fica_tax
-from models import User, Income, Asset, Debt, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency
+from tax_logic import calculate_federal_tax, calculate_state_tax, calculate_fica_tax, calculate_household_fica_tax, STATE_TAX_BRACKETS_2026
+from models import User, Income, Asset, Debt, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency, USState
 
-def calculate_net_worth(user: User, incomes: list[Income], assets: list[Asset], debts: list[Debt], retirement_accounts: list[RetirementAccount] = [], insurances: list[Insurance] = []):
+def annual_insurance_cost(insurances: list[Insurance]):
+    """Returns the annualized cost of all insurance premiums."""
+    total_annual_insurance = 0
+    for ins in insurances:
+        if ins.frequency == InsuranceFrequency.MONTHLY:
+            total_annual_insurance += ins.amount * 12
+        elif ins.frequency == InsuranceFrequency.EVERY_6_MONTHS:
+            total_annual_insurance += ins.amount * 2
+        elif ins.frequency == InsuranceFrequency.YEARLY:
+            total_annual_insurance += ins.amount
+    return total_annual_insurance
+
+def gross_income_for_year(incomes: list[Income], year: int):
+    """Returns the total gross income recorded for a given year."""
+    return sum(inc.amount for inc in incomes if getattr(inc, 'year', 2026) == year)
+
+def traditional_retirement_deductions(retirement_accounts: list[RetirementAccount], year: int):
+    """Returns the pre-tax (Traditional IRA/401k/403b) contributions for a given year."""
+    retirement_deductions = 0
+    for ra in retirement_accounts:
+        if ra.account_type in [AccountType.TRADITIONAL_IRA, AccountType.K401, AccountType.B403]:
+            if year == 2025:
+                retirement_deductions += ra.contributions_2025
+            elif year == 2026:
+                retirement_deductions += ra.contributions_2026
+    return retirement_deductions
+
+def compare_state_taxes(gross_income, taxable_income, filing_status='single'):
     """
-    Calculates the real-time net worth for a user.
-    Net Worth = Total Assets - Total Debts.
+    Evaluates the same income in every state of STATE_TAX_BRACKETS_2026.
+    Federal and FICA tax do not depend on the state, so they are computed once.
+    Returns rows ranked by state tax, lowest first.
+    """
+    fed_tax = calculate_federal_tax(taxable_income, filing_status)
+    fica_tax = calculate_fica_tax(gross_income, filing_status)
+
+    rows = []
+    for state_code in STATE_TAX_BRACKETS_2026:
+        state_tax = calculate_state_tax(taxable_income, state_code, filing_status)
+        total_tax = fed_tax + state_tax + fica_tax
+        rows.append({
+            "state": state_code,
+            "state_name": USState[state_code].value if state_code in USState.__members__ else state_code,
+            "state_tax": state_tax,
+            "federal_tax": fed_tax,
+            "fica_tax": fica_tax,
+            "total_tax": total_tax,
+            "net_income": gross_income - total_tax
+        })
+
+    rows.sort(key=lambda row: (row["state_tax"], row["state"]))
+    for rank, row in enumerate(rows, start=1):
+        row["rank"] = rank
+    return rows
+
+def calculate_balance_sheet(assets: list[Asset], debts: list[Debt], prices: dict = None):
+    """
+    Returns the market value of the assets, the outstanding debt and the net worth, without any tax.
+    If `prices` is given, market prices are looked up there instead of fetched.
     """
     total_assets_market_value = 0
     for asset in assets:
@@ -14,7 +69,7 @@ def calculate_net_worth(user: User, incomes: list[Income], assets: list[Asset],
             total_assets_market_value += asset.shares
         else:
             # For Stocks/Bonds, fetch the current price
-            current_price = get_current_price(asset.ticker)
+            current_price = prices.get(asset.ticker) if prices is not None else get_current_price(asset.ticker)
             if current_price is not None and current_price > 0:
                 total_assets_market_value += (current_price * asset.shares)
             else:
@@ -22,32 +77,32 @@ def calculate_net_worth(user: User, incomes: list[Income], assets: list[Asset],
                 total_assets_market_value += asset.cost_basis
 
     total_debts = sum(max(0, debt.initial_amount - debt.amount_paid) for debt in debts)
+    return {
+        "total_assets_market_value": total_assets_market_value,
+        "total_debts": total_debts,
+        "real_time_net_worth": total_assets_market_value - total_debts
+    }
+
+def calculate_net_worth(user: User, incomes: list[Income], assets: list[Asset], debts: list[Debt], retirement_accounts: list[RetirementAccount] = [], insurances: list[Insurance] = [], prices: dict = None, earners: list[list[Income]] = None):
+    """
+    Calculates the real-time net worth for a user.
+    Net Worth = Total Assets - Total Debts.
+    If `prices` is given, market prices are looked up there instead of fetched.
+    For a household, `earners` groups the incomes by person so FICA is capped per earner.
+    """
+    balances = calculate_balance_sheet(assets, debts, prices=prices)
     
     # Calculate insurance costs (annualized)
-    total_annual_insurance = 0
-    for ins in insurances:
-        if ins.frequency == InsuranceFrequency.MONTHLY:
-            total_annual_insurance += ins.amount * 12
-        elif ins.frequency == InsuranceFrequency.EVERY_6_MONTHS:
-            total_annual_insurance += ins.amount * 2
-        elif ins.frequency == InsuranceFrequency.YEARLY:
-            total_annual_insurance += ins.amount
+    total_annual_insurance = annual_insurance_cost(insurances)
 
     # Calculate taxes for 2025 and 2026
     tax_info = {}
     for year in [2025, 2026]:
         # Filter income for the specific year
-        year_incomes = [inc for inc in incomes if getattr(inc, 'year', 2026) == year]
-        gross_income = sum(inc.amount for inc in year_incomes)
+        gross_income = gross_income_for_year(incomes, year)
         
         # Calculate deductions from traditional retirement contributions
-        retirement_deductions = 0
-        for ra in retirement_accounts:
-            if ra.account_type in [AccountType.TRADITIONAL_IRA, AccountType.K401, AccountType.B403]:
-                if year == 2025:
-                    retirement_deductions += ra.contributions_2025
-                elif year == 2026:
-                    retirement_deductions += ra.contributions_2026
+        retirement_deductions = traditional_retirement_deductions(retirement_accounts, year)
         
         # Subtract insurance and retirement from gross for taxable income estimation
         taxable_income = max(0, gross_income - retirement_deductions - total_annual_insurance)
@@ -55,7 +110,10 @@ def calculate_net_worth(user: User, incomes: list[Income], assets: list[Asset],
         fed_tax = calculate_federal_tax(taxable_income, user.filing_status.value)
         state_tax = calculate_state_tax(taxable_income, user.state.name, user.filing_status.value)
         # FICA is usually on gross income
-        fica_tax = calculate_fica_tax(gross_income, user.filing_status.value)
+        if earners is not None:
+            fica_tax = calculate_household_fica_tax([gross_income_for_year(e, year) for e in earners], user.filing_status.value)
+        else:
+            fica_tax = calculate_fica_tax(gross_income, user.filing_status.value)
         
         tax_info[year] = {
             "gross_income": gross_income,
@@ -71,18 +129,16 @@ def calculate_net_worth(user: User, incomes: list[Income], assets: list[Asset],
     # Default to 2026 for the dashboard summary
     current_year_tax = tax_info[2026]
 
-    real_time_net_worth = total_assets_market_value - total_debts
-
     return {
-        "total_assets_market_value": total_assets_market_value,
-        "total_debts": total_debts,
+        "total_assets_market_value": balances['total_assets_market_value'],
+        "total_debts": balances['total_debts'],
         "total_income": current_year_tax['gross_income'], 
         "total_annual_insurance": total_annual_insurance,
         "estimated_federal_tax": current_year_tax['federal_tax'],
         "estimated_state_tax": current_year_tax['state_tax'],
         "estimated_fica_tax": current_year_tax['fica_tax'],
         "estimated_tax_liability": current_year_tax['total_tax'],
-        "real_time_net_worth": real_time_net_worth,
+        "real_time_net_worth": balances['real_time_net_worth'],
         "tax_details": tax_info
     }
 
@@ -0,0 +1,61 @@
+"""
+Streaming export of a user's stored financial data as newline-delimited JSON.
+
+Every line is one object {"type": ..., "data": {...}}: a 'header' line, the
+'profile' (filing status and state), then 'retirement_account', 'insurance',
+'income', 'asset' and 'debt' records, the stored history ('tax_lot',
+'transaction_month', 'recurring_charges'), and finally an 'end' line with the
+number of records of each type. An export without its 'end' line was cut
+short.
+
+Items are read a page at a time and each page is written out before the next
+is read, so memory stays bounded by EXPORT_PAGE_SIZE however large the
+account. Nothing is priced or computed; values are exactly as stored.
+"""
+import json
+import logging
+import time
+from repository import get_user_profile, iter_user_items
+from firestore_db import iter_user_history, income_to_record, asset_to_record, debt_to_record, retirement_account_to_record, insurance_to_record
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_PAGE_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+ITEM_EXPORTS = [
+    ('incomes', 'income', income_to_record),
+    ('assets', 'asset', asset_to_record),
+    ('debts', 'debt', debt_to_record)
+]
+
+def to_ndjson(kind, records):
+    """Serializes records of one type as NDJSON lines."""
+    # Firestore timestamps are the only non-JSON values stored; write them as text
+    return ''.join(json.dumps({'type': kind, 'data': record}, separators=(',', ':'), default=str) + '\n' for record in records)
+
+def _iter_records(user_id, page_size):
+    """Yields (type, records) pages in export order."""
+    user, retirement_accounts, insurances = get_user_profile(user_id=user_id)
+    yield 'profile', [{'filing_status': user.filing_status.name, 'state': user.state.name}]
+    yield 'retirement_account', [retirement_account_to_record(ra) for ra in retirement_accounts]
+    yield 'insurance', [insurance_to_record(ins) for ins in insurances]
+    for collection, kind, to_record in ITEM_EXPORTS:
+        for page in iter_user_items(collection, user_id=user_id, page_size=page_size):
+            yield kind, [to_record(item) for item in page]
+    yield from iter_user_history(user_id=user_id, page_size=page_size)
+
+def export_user_data(user_id, page_size=EXPORT_PAGE_SIZE):
+    """Yields the user's export as NDJSON text, one chunk per page read."""
+    # Sent before any read so the client sees the response start immediately
+    yield to_ndjson('header', [{'format_version': EXPORT_FORMAT_VERSION, 'user_id': user_id, 'exported_at': time.time()}])
+    counts = {}
+    try:
+        for kind, records in _iter_records(user_id, page_size):
+            if records:
+                counts[kind] = counts.get(kind, 0) + len(records)
+                yield to_ndjson(kind, records)
+    except Exception as e:
+        # The status line is already sent; ending without the 'end' line marks the export incomplete
+        logging.error(f"Export of user {user_id} failed: {e}")
+        return
+    yield to_ndjson('end', [{'counts': counts}])
@@ -1,7 +1,13 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-from models import User, Income, Asset, Debt, FilingStatus, USState, IncomeType, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency, HourlyType
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core.exceptions import Conflict, FailedPrecondition
+from models import User, Income, Asset, Debt, FilingStatus, USState, IncomeType, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency, HourlyType, TaxLot
+from datetime import date
+import hashlib
+import json
 import logging
+import uuid
 
 # We move the client creation inside a function so it doesn't slow down the boot-up
 def get_db():
@@ -22,140 +28,724 @@ def get_db():
         logging.error(f"Failed to create Firestore client: {e}")
         return None
 
+# Storage layouts of users/{uid}:
+#   1 (legacy): everything embedded as arrays on the user document.
+#   2: summary fields, retirement accounts and insurances on the user document;
+#      incomes, assets and debts as one document per entry in subcollections,
+#      keyed by zero-padded position, with the number of entries in 'counts'.
+#   3: as 2, but entry documents are keyed by a hash of their content plus a
+#      token of the save that wrote them, and the user document lists each
+#      collection's ids, in order, under 'items'. Entry documents never change
+#      once written: a save keeps the ids of entries whose content is already
+#      listed, writes the rest under its own token, publishes the new lists in
+#      one conditional write of the user document, then deletes the entries no
+#      longer listed. Ids are only ever carried over from the published lists,
+#      so a later save cannot list an id an earlier save is deleting. Readers
+#      fetch exactly the ids listed in the user document they read, so they see
+#      one save or the next, never a mix of both.
+LAYOUT_VERSION = 3
+ITEM_COLLECTIONS = ['incomes', 'assets', 'debts']
+BATCH_LIMIT = 500  # Firestore write batch limit
+# A save re-reads and retries when another save changed the user document first
+SAVE_ATTEMPTS = 3
+# A read retries when a newer save deleted entries it had not fetched yet
+READ_ATTEMPTS = 3
+
+# market_data/held_tickers lists every market ticker held by any user, so the
+# quote prewarmer reads one document instead of scanning every portfolio. Saves
+# add to it; rebuild_held_tickers() rewrites it to drop tickers nobody holds.
+HELD_TICKERS_DOC = 'held_tickers'
+
+def item_id(position):
+    return f"{position:06d}"
+
+def content_hash(record):
+    """A hash of an item record's content, the first part of its layout 3 document id."""
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()[:20]
+
+def _entry_ids(records, listed_ids, save_token):
+    """
+    Returns the layout 3 ids for a save of `records`: the listed id of an entry
+    with the same content where there is one, else the content hash tagged
+    with this save's token.
+    """
+    reusable = {}
+    for doc_id in listed_ids:
+        reusable.setdefault(doc_id.split('-')[0], []).append(doc_id)
+    ids = []
+    for record in records:
+        digest = content_hash(record)
+        matches = reusable.get(digest)
+        ids.append(matches.pop(0) if matches else f"{digest}-{save_token}")
+    return ids
+
+def _embedded(data):
+    """True for a layout 1 user document, whose items are arrays on the document itself."""
+    return data.get('layout_version', 1) < 2
+
+def _listed_ids(data, name):
+    """Returns the document ids of a layout 2 or 3 user's entries of one collection, in list order."""
+    if data.get('layout_version', 1) >= 3:
+        return data.get('items', {}).get(name, [])
+    # Layout 2 entries are keyed by position; read no further than the saved count
+    return [item_id(position) for position in range(data.get('counts', {}).get(name, 0))]
+
+def held_tickers(asset_records):
+    """Returns the sorted market tickers in a list of asset records."""
+    return sorted({ass['ticker'] for ass in asset_records if ass.get('asset_type') in ['STOCK', 'BOND'] and ass.get('ticker')})
+
+def _register_tickers(db, tickers):
+    if tickers:
+        db.collection('market_data').document(HELD_TICKERS_DOC).set({'tickers': firestore.ArrayUnion(list(tickers))}, merge=True)
+
+def income_from_dict(inc):
+    return Income(
+        income_type=IncomeType[inc['income_type']],
+        hourly_type=HourlyType[inc.get('hourly_type', 'REPEATING')],
+        amount=inc['amount'],
+        monthly_income=inc.get('monthly_income'),
+        hourly_wage=inc.get('hourly_wage'),
+        hours_worked=inc.get('hours_worked'),
+        year=inc.get('year', 2026)
+    )
+
+def asset_from_dict(ass):
+    asset = Asset(
+        ticker=ass['ticker'],
+        shares=ass['shares'],
+        cost_basis=ass['cost_basis'],
+        asset_type=AssetType[ass['asset_type']]
+    )
+    if 'retirement_account_id' in ass:
+        asset.retirement_account_id = ass['retirement_account_id']
+    return asset
+
+def debt_from_dict(dbt):
+    return Debt(
+        name=dbt['name'],
+        initial_amount=dbt['initial_amount'],
+        amount_paid=dbt['amount_paid'],
+        monthly_payment=dbt.get('monthly_payment'),
+        interest_rate=dbt.get('interest_rate')
+    )
+
+def retirement_account_from_dict(ra):
+    return RetirementAccount(
+        id=ra.get('id'), # Use Firestore provided ID or generate one if missing? Actually client should provide unique IDs or name is key
+        name=ra['name'],
+        account_type=AccountType[ra['account_type']],
+        contributions_2025=ra.get('contributions_2025', 0.0),
+        contributions_2026=ra.get('contributions_2026', 0.0)
+    )
+
+def insurance_from_dict(ins):
+    return Insurance(
+        name=ins['name'],
+        amount=ins['amount'],
+        frequency=InsuranceFrequency[ins['frequency']]
+    )
+
+def income_to_record(i):
+    return {
+        'income_type': i.income_type.name,
+        'hourly_type': i.hourly_type.name if i.hourly_type else 'REPEATING',
+        'amount': i.amount,
+        'monthly_income': i.monthly_income,
+        'hourly_wage': i.hourly_wage,
+        'hours_worked': i.hours_worked,
+        'year': i.year
+    }
+
+def asset_to_record(a):
+    return {
+        'ticker': a.ticker,
+        'shares': a.shares,
+        'cost_basis': a.cost_basis,
+        'asset_type': a.asset_type.name,
+        'retirement_account_id': getattr(a, 'retirement_account_id', None)
+    }
+
+def debt_to_record(d):
+    return {
+        'name': d.name,
+        'initial_amount': d.initial_amount,
+        'amount_paid': d.amount_paid,
+        'monthly_payment': d.monthly_payment,
+        'interest_rate': d.interest_rate
+    }
+
+def retirement_account_to_record(r):
+    return {
+        'id': r.id,
+        'name': r.name,
+        'account_type': r.account_type.name,
+        'contributions_2025': r.contributions_2025,
+        'contributions_2026': r.contributions_2026
+    }
+
+def insurance_to_record(ins):
+    return {
+        'name': ins.name,
+        'amount': ins.amount,
+        'frequency': ins.frequency.name
+    }
+
+ITEM_FROM_DICT = {'incomes': income_from_dict, 'assets': asset_from_dict, 'debts': debt_from_dict}
+
+def empty_user_data():
+    return (
+        User(filing_status=FilingStatus.SINGLE, state=USState.CA),
+        [],
+        [],
+        [],
+        [],
+        []
+    )
+
+def _get_entries(db, requests):
+    """
+    Reads the entries of several (user_ref, collection, ids) requests in one
+    get_all. Returns each request's records in list order, or None for a
+    request with an entry that a newer save has already deleted.
+    """
+    refs = {}
+    for user_ref, name, ids in requests:
+        collection = user_ref.collection(name)
+        for doc_id in ids:
+            ref = collection.document(doc_id)
+            refs.setdefault(ref.path, ref)
+    found = {doc.reference.path: doc.to_dict() for doc in db.get_all(list(refs.values())) if doc.exists} if refs else {}
+    results = []
+    for user_ref, name, ids in requests:
+        paths = [f"{user_ref.path}/{name}/{doc_id}" for doc_id in ids]
+        results.append([found[path] for path in paths] if all(path in found for path in paths) else None)
+    return results
+
+def _read_item_records(db, user_ref, data):
+    """Returns {collection: [record, ...]} for any storage layout, or None if a newer save deleted a listed entry."""
+    if _embedded(data):
+        return {name: data.get(name, []) for name in ITEM_COLLECTIONS}
+    records = dict(zip(ITEM_COLLECTIONS, _get_entries(db, [(user_ref, name, _listed_ids(data, name)) for name in ITEM_COLLECTIONS])))
+    return None if None in records.values() else records
+
+def _read_user(db, user_ref):
+    """Returns (data, records) of a user document and its entries, or (None, None) if there is no document."""
+    for _ in range(READ_ATTEMPTS):
+        doc = user_ref.get()
+        if not doc.exists:
+            return None, None
+        data = doc.to_dict()
+        records = _read_item_records(db, user_ref, data)
+        if records is not None:
+            return data, records
+    raise RuntimeError(f"Entries of user {user_ref.id} kept changing while being read")
+
+def _user_data_from(data, records):
+    """Reconstructs the model objects from a user document and its item records."""
+    user = User(
+        filing_status=FilingStatus[data.get('filing_status', 'SINGLE')],
+        state=USState[data.get('state', 'CA')]
+    )
+    incomes = [income_from_dict(inc) for inc in records['incomes']]
+    assets = [asset_from_dict(ass) for ass in records['assets']]
+    debts = [debt_from_dict(dbt) for dbt in records['debts']]
+    retirement_accounts = [retirement_account_from_dict(ra) for ra in data.get('retirement_accounts', [])]
+    insurances = [insurance_from_dict(ins) for ins in data.get('insurances', [])]
+    return user, incomes, assets, debts, retirement_accounts, insurances
+
 def get_user_data(user_id="default_user"):
     """Fetches user tax info, incomes, assets, debts, retirement accounts, and insurances from Firestore."""
     db = get_db()
     if db is None:
-        return (
-            User(filing_status=FilingStatus.SINGLE, state=USState.CA),
-            [],
-            [],
-            [],
-            [],
-            []
-        )
+        return empty_user_data()
+    data, records = _read_user(db, db.collection('users').document(user_id))
+    if data is None:
+        # Return empty state if not found (don't force demo data on new users)
+        return empty_user_data()
+    return _user_data_from(data, records)
+
+def get_users_data(user_ids):
+    """
+    Fetches several users' data as {user_id: (user, incomes, assets, debts, retirement_accounts, insurances)}.
+    The user documents are read in one batched get_all and every user's entries
+    in a second one, so this takes about as long as one get_user_data.
+    """
+    db = get_db()
+    if db is None:
+        return {user_id: empty_user_data() for user_id in user_ids}
+    refs = {user_id: db.collection('users').document(user_id) for user_id in user_ids}
+    documents = {doc.id: doc.to_dict() for doc in db.get_all(list(refs.values())) if doc.exists}
+
+    listed = [user_id for user_id, data in documents.items() if not _embedded(data)]
+    entries = iter(_get_entries(db, [(refs[user_id], name, _listed_ids(documents[user_id], name)) for user_id in listed for name in ITEM_COLLECTIONS]))
+    records = {user_id: {name: next(entries) for name in ITEM_COLLECTIONS} for user_id in listed}
+    result = {}
+    for user_id in user_ids:
+        data = documents.get(user_id)
+        if data is None:
+            result[user_id] = empty_user_data()
+        elif _embedded(data):
+            result[user_id] = _user_data_from(data, _read_item_records(db, refs[user_id], data))
+        elif None in records[user_id].values():
+            # A save replaced this user's entries mid-read; read them again on their own
+            data, user_records = _read_user(db, refs[user_id])
+            result[user_id] = _user_data_from(data, user_records) if data is not None else empty_user_data()
+        else:
+            result[user_id] = _user_data_from(data, records[user_id])
+    return result
+
+def _commit_in_batches(db, writes):
+    """Applies (ref, record) writes in batches of BATCH_LIMIT; a None record deletes the document."""
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, record in writes[start:start + BATCH_LIMIT]:
+            if record is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, record)
+        batch.commit()
+
+def _write_layout(db, user_ref, previous, summary, item_records):
+    """
+    Writes the summary and items in layout 3 over the user document snapshot
+    `previous`. Returns False, having published nothing, if the user document
+    changed after `previous` was read.
+    """
+    previous_data = (previous.to_dict() or {}) if previous.exists else {}
+    listed = {name: set() if _embedded(previous_data) else set(_listed_ids(previous_data, name)) for name in ITEM_COLLECTIONS}
+    save_token = uuid.uuid4().hex[:8]
+    ids = {name: _entry_ids(records, [] if _embedded(previous_data) else _listed_ids(previous_data, name), save_token) for name, records in item_records.items()}
+
+    # Entries are invisible until the user document lists them, so these
+    # batches need not be atomic; entries already listed are not rewritten
+    _commit_in_batches(db, [
+        (user_ref.collection(name).document(doc_id), record)
+        for name, records in item_records.items()
+        for doc_id, record in dict(zip(ids[name], records)).items()
+        if doc_id not in listed[name]
+    ])
+
+    fields = dict(summary, layout_version=LAYOUT_VERSION, items=ids, counts={name: len(records) for name, records in item_records.items()})
+    try:
+        if previous.exists:
+            # A layout 1 document's embedded arrays are dropped in the same write
+            fields.update({name: firestore.DELETE_FIELD for name in ITEM_COLLECTIONS if name in previous_data})
+            user_ref.update(fields, option=db.write_option(last_update_time=previous.update_time))
+        else:
+            user_ref.create(fields)
+    except (FailedPrecondition, Conflict):
+        return False
+
+    _commit_in_batches(db, [
+        (user_ref.collection(name).document(doc_id), None)
+        for name in ITEM_COLLECTIONS
+        for doc_id in listed[name] - set(ids[name])
+    ])
+    return True
+
+def save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id="default_user"):
+    """Saves the entire state to Firestore, writing only the entries that changed."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
     user_ref = db.collection('users').document(user_id)
-    doc = user_ref.get()
     
-    if not doc.exists:
-        # Return empty state if not found (don't force demo data on new users)
-        return (
-            User(filing_status=FilingStatus.SINGLE, state=USState.CA),
-            [],
-            [],
-            [],
-            [],
-            []
-        )
+    item_records = {
+        'incomes': [income_to_record(i) for i in incomes],
+        'assets': [asset_to_record(a) for a in assets],
+        'debts': [debt_to_record(d) for d in debts]
+    }
+    summary = {
+        'filing_status': user.filing_status.name,
+        'state': user.state.name,
+        'retirement_accounts': [retirement_account_to_record(r) for r in retirement_accounts],
+        'insurances': [insurance_to_record(ins) for ins in insurances],
+        'tickers': held_tickers(item_records['assets'])
+    }
     
+    for _ in range(SAVE_ATTEMPTS):
+        previous = user_ref.get()
+        if _write_layout(db, user_ref, previous, summary, item_records):
+            # Only tickers this user did not hold before can be new to the registry
+            previous_tickers = (previous.to_dict() or {}).get('tickers', []) if previous.exists else []
+            _register_tickers(db, set(summary['tickers']) - set(previous_tickers))
+            return
+    raise RuntimeError(f"User {user_id} kept changing during the save; gave up after {SAVE_ATTEMPTS} attempts")
+
+def save_user_profile(user, user_id="default_user"):
+    """Saves only the filing status and state, leaving the user's items untouched."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('users').document(user_id).set({
+        'filing_status': user.filing_status.name,
+        'state': user.state.name
+    }, merge=True)
+
+def migrate_user_to_subcollections(user_id):
+    """Rewrites a layout 1 or 2 user document in the current layout. Returns True if migrated."""
+    db = get_db()
+    if db is None:
+        return False
+    user_ref = db.collection('users').document(user_id)
+    for _ in range(SAVE_ATTEMPTS):
+        previous = user_ref.get()
+        if not previous.exists:
+            return False
+        data = previous.to_dict()
+        if data.get('layout_version', 1) >= LAYOUT_VERSION:
+            return False
+        item_records = _read_item_records(db, user_ref, data)
+        if item_records is None:
+            continue
+        summary = {key: value for key, value in data.items() if key not in ITEM_COLLECTIONS}
+        summary['tickers'] = held_tickers(item_records['assets'])
+        if _write_layout(db, user_ref, previous, summary, item_records):
+            _register_tickers(db, summary['tickers'])
+            return True
+    return False
+
+def list_user_items(collection, user_id="default_user", limit=50, cursor=None):
+    """
+    Returns one page of a user's incomes, assets or debts as model objects,
+    plus the cursor for the next page (None on the last page). Only the
+    requested page is read.
+    """
+    from_dict = ITEM_FROM_DICT[collection]
+    db = get_db()
+    if db is None:
+        return [], None
+    user_ref = db.collection('users').document(user_id)
+    # The cursor is the zero-padded position of the last entry returned
+    start = int(cursor) + 1 if cursor else 0
+    for _ in range(READ_ATTEMPTS):
+        doc = user_ref.get()
+        if not doc.exists:
+            return [], None
+        data = doc.to_dict()
+        if _embedded(data):
+            listed = data.get(collection, [])
+            page = listed[start:start + limit]
+        else:
+            listed = _listed_ids(data, collection)
+            page = _get_entries(db, [(user_ref, collection, listed[start:start + limit])])[0]
+            if page is None:
+                continue
+        next_cursor = item_id(start + limit - 1) if start + limit < len(listed) else None
+        return [from_dict(record) for record in page], next_cursor
+    raise RuntimeError(f"Entries of user {user_id} kept changing while being read")
+
+def _iter_pages(collection_ref, page_size):
+    """Yields a collection's documents in id order, one page at a time; only the current page is held."""
+    cursor = None
+    while True:
+        query = collection_ref.order_by(FieldPath.document_id())
+        if cursor is not None:
+            query = query.start_after({FieldPath.document_id(): cursor})
+        docs = list(query.limit(page_size).stream())
+        if docs:
+            yield docs
+        if len(docs) < page_size:
+            return
+        cursor = docs[-1].id
+
+def get_user_profile(user_id="default_user"):
+    """Fetches (user, retirement_accounts, insurances) from the user document alone, without the item subcollections."""
+    db = get_db()
+    if db is None:
+        user, _, _, _, retirement_accounts, insurances = empty_user_data()
+        return user, retirement_accounts, insurances
+    doc = db.collection('users').document(user_id).get()
+    if not doc.exists:
+        user, _, _, _, retirement_accounts, insurances = empty_user_data()
+        return user, retirement_accounts, insurances
     data = doc.to_dict()
-    
-    # Reconstruct objects
     user = User(
         filing_status=FilingStatus[data.get('filing_status', 'SINGLE')],
         state=USState[data.get('state', 'CA')]
     )
-    
-    incomes = []
-    for inc in data.get('incomes', []):
-        incomes.append(Income(
-            income_type=IncomeType[inc['income_type']],
-            hourly_type=HourlyType[inc.get('hourly_type', 'REPEATING')],
-            amount=inc['amount'],
-            monthly_income=inc.get('monthly_income'),
-            hourly_wage=inc.get('hourly_wage'),
-            hours_worked=inc.get('hours_worked'),
-            year=inc.get('year', 2026)
-        ))
-        
-    assets = []
-    for ass in data.get('assets', []):
-        asset = Asset(
-            ticker=ass['ticker'],
-            shares=ass['shares'],
-            cost_basis=ass['cost_basis'],
-            asset_type=AssetType[ass['asset_type']]
-        )
-        if 'retirement_account_id' in ass:
-            asset.retirement_account_id = ass['retirement_account_id']
-        assets.append(asset)
-        
-    debts = []
-    for dbt in data.get('debts', []):
-        debts.append(Debt(
-            name=dbt['name'],
-            initial_amount=dbt['initial_amount'],
-            amount_paid=dbt['amount_paid'],
-            monthly_payment=dbt.get('monthly_payment'),
-            interest_rate=dbt.get('interest_rate')
-        ))
-
-    retirement_accounts = []
-    for ra in data.get('retirement_accounts', []):
-        retirement_accounts.append(RetirementAccount(
-            id=ra.get('id'), # Use Firestore provided ID or generate one if missing? Actually client should provide unique IDs or name is key
-            name=ra['name'],
-            account_type=AccountType[ra['account_type']],
-            contributions_2025=ra.get('contributions_2025', 0.0),
-            contributions_2026=ra.get('contributions_2026', 0.0)
-        ))
-
-    insurances = []
-    for ins in data.get('insurances', []):
-        insurances.append(Insurance(
-            name=ins['name'],
-            amount=ins['amount'],
-            frequency=InsuranceFrequency[ins['frequency']]
-        ))
-        
-    return user, incomes, assets, debts, retirement_accounts, insurances
+    retirement_accounts = [retirement_account_from_dict(ra) for ra in data.get('retirement_accounts', [])]
+    insurances = [insurance_from_dict(ins) for ins in data.get('insurances', [])]
+    return user, retirement_accounts, insurances
 
-def save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id="default_user"):
-    """Saves the entire state to Firestore."""
+def iter_user_items(collection, user_id="default_user", page_size=500):
+    """
+    Yields a user's incomes, assets or debts as lists of model objects, reading
+    one page per step. All pages come from the save current at the first read;
+    raises RuntimeError if a newer save deletes entries before they are read.
+    """
+    from_dict = ITEM_FROM_DICT[collection]
     db = get_db()
     if db is None:
-        logging.warning("Skipping save to Firestore because the client is not initialized.")
         return
     user_ref = db.collection('users').document(user_id)
-    
-    data = {
-        'filing_status': user.filing_status.name,
-        'state': user.state.name,
-        'incomes': [{
-            'income_type': i.income_type.name,
-            'hourly_type': i.hourly_type.name if i.hourly_type else 'REPEATING',
-            'amount': i.amount,
-            'monthly_income': i.monthly_income,
-            'hourly_wage': i.hourly_wage,
-            'hours_worked': i.hours_worked,
-            'year': i.year
-        } for i in incomes],
-        'assets': [{
-            'ticker': a.ticker,
-            'shares': a.shares,
-            'cost_basis': a.cost_basis,
-            'asset_type': a.asset_type.name,
-            'retirement_account_id': getattr(a, 'retirement_account_id', None)
-        } for a in assets],
-        'debts': [{
-            'name': d.name,
-            'initial_amount': d.initial_amount,
-            'amount_paid': d.amount_paid,
-            'monthly_payment': d.monthly_payment,
-            'interest_rate': d.interest_rate
-        } for d in debts],
-        'retirement_accounts': [{
-            'id': r.id,
-            'name': r.name,
-            'account_type': r.account_type.name,
-            'contributions_2025': r.contributions_2025,
-            'contributions_2026': r.contributions_2026
-        } for r in retirement_accounts],
-        'insurances': [{
-            'name': ins.name,
-            'amount': ins.amount,
-            'frequency': ins.frequency.name
-        } for ins in insurances]
+    doc = user_ref.get()
+    if not doc.exists:
+        return
+    data = doc.to_dict()
+    if _embedded(data):
+        records = data.get(collection, [])
+        for start in range(0, len(records), page_size):
+            yield [from_dict(record) for record in records[start:start + page_size]]
+        return
+    listed = _listed_ids(data, collection)
+    for start in range(0, len(listed), page_size):
+        page = _get_entries(db, [(user_ref, collection, listed[start:start + page_size])])[0]
+        if page is None:
+            raise RuntimeError(f"Entries of user {user_id} were replaced during the read")
+        yield [from_dict(record) for record in page]
+
+def iter_user_history(user_id="default_user", page_size=500):
+    """
+    Yields (kind, records) pages of the user's stored history: 'tax_lot',
+    'transaction_month' and 'recurring_charges' records, in that order.
+    """
+    db = get_db()
+    if db is None:
+        return
+    user_ref = db.collection('users').document(user_id)
+    for docs in _iter_pages(user_ref.collection('tax_lots'), page_size):
+        yield 'tax_lot', [dict(tax_lot_to_record(tax_lot_from_dict(d.id, d.to_dict())), id=d.id) for d in docs]
+    for docs in _iter_pages(user_ref.collection('transaction_months'), page_size):
+        yield 'transaction_month', [dict(d.to_dict(), month=d.id) for d in docs]
+    doc = user_ref.collection('transaction_summary').document('recurring').get()
+    if doc.exists:
+        yield 'recurring_charges', [doc.to_dict()]
+
+def tax_lot_from_dict(lot_id, lot):
+    return TaxLot(
+        id=lot_id,
+        ticker=lot['ticker'],
+        shares=lot['shares'],
+        cost_basis=lot['cost_basis'],
+        acquired=date.fromisoformat(lot['acquired']),
+        retirement_account_id=lot.get('retirement_account_id')
+    )
+
+def tax_lot_to_record(lot):
+    return {
+        'ticker': lot.ticker,
+        'shares': lot.shares,
+        'cost_basis': lot.cost_basis,
+        'acquired': lot.acquired.isoformat(),
+        'retirement_account_id': lot.retirement_account_id
     }
-    
-    user_ref.set(data)
+
+def get_tax_lots(user_id="default_user", ticker=None):
+    """Fetches the user's tax lots (users/{uid}/tax_lots/{lot_id}), optionally for one ticker."""
+    db = get_db()
+    if db is None:
+        return []
+    query = db.collection('users').document(user_id).collection('tax_lots')
+    if ticker:
+        query = query.where(filter=firestore.FieldFilter('ticker', '==', ticker))
+    return [tax_lot_from_dict(doc.id, doc.to_dict()) for doc in query.stream()]
+
+def save_tax_lots(lots, user_id="default_user"):
+    """Replaces the user's tax lots, deleting lots no longer present."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    collection = db.collection('users').document(user_id).collection('tax_lots')
+    existing_ids = {doc.id for doc in collection.select([]).stream()}
+    keep_ids = {lot.id for lot in lots}
+    writes = [(collection.document(lot.id), tax_lot_to_record(lot)) for lot in lots]
+    writes += [(collection.document(lot_id), None) for lot_id in existing_ids - keep_ids]
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, record in writes[start:start + BATCH_LIMIT]:
+            if record is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, record)
+        batch.commit()
+
+def get_transaction_month(month, user_id="default_user"):
+    """Fetches the stored transaction aggregate for one month ('YYYY-MM'), or None."""
+    db = get_db()
+    if db is None:
+        return None
+    doc = db.collection('users').document(user_id).collection('transaction_months').document(month).get()
+    return doc.to_dict() if doc.exists else None
+
+def save_transaction_month(month, data, user_id="default_user"):
+    """Saves the transaction aggregate for one month ('YYYY-MM')."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('users').document(user_id).collection('transaction_months').document(month).set(data)
+
+def get_recurring_charges(user_id="default_user"):
+    """Fetches the user's stored recurring charges."""
+    db = get_db()
+    if db is None:
+        return []
+    doc = db.collection('users').document(user_id).collection('transaction_summary').document('recurring').get()
+    return doc.to_dict().get('charges', []) if doc.exists else []
+
+def save_recurring_charges(charges, user_id="default_user"):
+    """Saves the user's recurring charges, as merged by the last transaction import."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('users').document(user_id).collection('transaction_summary').document('recurring').set({'charges': charges})
+
+def get_all_held_tickers():
+    """Returns the set of market tickers held by any user, from the held-ticker registry (one read)."""
+    db = get_db()
+    if db is None:
+        return set()
+    doc = db.collection('market_data').document(HELD_TICKERS_DOC).get()
+    if not doc.exists:
+        return rebuild_held_tickers()
+    return set(doc.to_dict().get('tickers', []))
+
+def rebuild_held_tickers():
+    """
+    Rewrites the held-ticker registry from the users' portfolios, dropping tickers
+    nobody holds any more. Reads only the tickers field of each user document,
+    except for users saved before that field existed. Returns the ticker set.
+    """
+    db = get_db()
+    if db is None:
+        return set()
+    tickers = set()
+    for doc in db.collection('users').select(['tickers', 'assets', 'layout_version', 'items', 'counts']).stream():
+        data = doc.to_dict() or {}
+        if 'tickers' in data:
+            tickers.update(data['tickers'])
+        elif _embedded(data):
+            # Users not yet migrated still embed their assets in the user document
+            tickers.update(held_tickers(data.get('assets', [])))
+        else:
+            assets = _get_entries(db, [(doc.reference, 'assets', _listed_ids(data, 'assets'))])[0]
+            tickers.update(held_tickers(assets or []))
+    db.collection('market_data').document(HELD_TICKERS_DOC).set({'tickers': sorted(tickers)})
+    return tickers
+
+def get_quote_snapshot():
+    """Fetches the shared quote snapshot ({'prices': {...}, 'updated_at': epoch seconds}), or None."""
+    db = get_db()
+    if db is None:
+        return None
+    doc = db.collection('market_data').document('quote_snapshot').get()
+    return doc.to_dict() if doc.exists else None
+
+def save_quote_snapshot(prices, updated_at):
+    """Publishes the shared quote snapshot read by every instance."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('market_data').document('quote_snapshot').set({'prices': prices, 'updated_at': updated_at})
+
+def save_request_profile(record):
+    """Stores a request profile under request_profiles/{profile_id}."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('request_profiles').document(record['profile_id']).set(record)
+
+def get_request_profile(profile_id):
+    """Fetches a stored request profile, or None."""
+    db = get_db()
+    if db is None:
+        return None
+    doc = db.collection('request_profiles').document(profile_id).get()
+    return doc.to_dict() if doc.exists else None
+
+def record_audit_event(event):
+    """Appends an entry to the audit_log collection under a generated id."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('audit_log').document().set(event)
+
+def find_household(user_id):
+    """Returns (household_id, household) for the household the user belongs to, or (None, None)."""
+    db = get_db()
+    if db is None:
+        return None, None
+    query = db.collection('households').where(filter=firestore.FieldFilter('members', 'array_contains', user_id))
+    for doc in query.limit(1).stream():
+        return doc.id, doc.to_dict()
+    return None, None
+
+def find_household_by_invite(invite_code):
+    """Returns (household_id, household) for an invite code, or (None, None)."""
+    db = get_db()
+    if db is None:
+        return None, None
+    query = db.collection('households').where(filter=firestore.FieldFilter('invite_code', '==', invite_code))
+    for doc in query.limit(1).stream():
+        return doc.id, doc.to_dict()
+    return None, None
+
+def save_household(household_id, household):
+    """Creates or replaces households/{household_id}."""
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    db.collection('households').document(household_id).set(household)
+
+def add_household_member(household_id, user_id, max_members):
+    """
+    Adds a member in a transaction that re-reads the member list, so concurrent
+    joins neither overwrite each other nor exceed max_members. Returns the
+    household as stored afterwards (without the user if it was full), or None
+    if it no longer exists.
+    """
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return None
+    ref = db.collection('households').document(household_id)
+
+    @firestore.transactional
+    def join(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        household = snapshot.to_dict()
+        if user_id in household['members'] or len(household['members']) >= max_members:
+            return household
+        household['members'].append(user_id)
+        transaction.update(ref, {'members': household['members']})
+        return household
+    return join(db.transaction())
+
+def remove_household_member(household_id, user_id):
+    """
+    Removes a member in a transaction. The last member to leave deletes the
+    household; an owner who leaves hands it to the longest-standing member.
+    """
+    db = get_db()
+    if db is None:
+        logging.warning("Skipping save to Firestore because the client is not initialized.")
+        return
+    ref = db.collection('households').document(household_id)
+
+    @firestore.transactional
+    def leave(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return
+        household = snapshot.to_dict()
+        # Members are kept in joining order
+        members = [member for member in household['members'] if member != user_id]
+        if not members:
+            transaction.delete(ref)
+            return
+        fields = {'members': members}
+        if household['owner'] == user_id:
+            fields['owner'] = members[0]
+        transaction.update(ref, fields)
+    leave(db.transaction())
@@ -0,0 +1,67 @@
+"""
+Households: several logins whose portfolios are viewed and taxed together,
+e.g. a married couple filing jointly who keep separate accounts.
+
+A household is stored in households/{id} with its member uids, the filing
+status and state of the joint return, and an invite code that other users
+join with. The household dashboard reads every member's data in one batched
+fetch and prices the union of their tickers once, so it costs about as much
+as a single user's dashboard however many members there are.
+"""
+import secrets
+from models import User, FilingStatus, USState
+
+MAX_HOUSEHOLD_MEMBERS = 6
+DEFAULT_FILING_STATUS = FilingStatus.MARRIED_FILING_JOINTLY
+
+class HouseholdError(ValueError):
+    pass
+
+def parse_tax_profile(data, default_state):
+    """Returns (filing_status, state) for a household from a request body. Raises HouseholdError."""
+    filing_status = data.get('filing_status', DEFAULT_FILING_STATUS.name)
+    state = data.get('state', default_state.name)
+    if filing_status not in FilingStatus.__members__:
+        raise HouseholdError(f"Invalid filing status: {filing_status}")
+    if state not in USState.__members__:
+        raise HouseholdError(f"Invalid state: {state}")
+    return FilingStatus[filing_status], USState[state]
+
+def new_household(owner_id, filing_status, state):
+    return {
+        'owner': owner_id,
+        'members': [owner_id],
+        'filing_status': filing_status.name,
+        'state': state.name,
+        'invite_code': secrets.token_urlsafe(12)
+    }
+
+def household_user(household):
+    """The User the joint return is computed for."""
+    return User(filing_status=FilingStatus[household['filing_status']], state=USState[household['state']])
+
+def household_to_dict(household_id, household):
+    return {
+        'id': household_id,
+        'owner': household['owner'],
+        'members': household['members'],
+        'filing_status': household['filing_status'],
+        'state': household['state'],
+        'invite_code': household['invite_code']
+    }
+
+def merge_portfolios(portfolios):
+    """
+    Combines members' (user, incomes, assets, debts, retirement_accounts, insurances)
+    tuples into one portfolio. Returns (incomes, assets, debts, retirement_accounts,
+    insurances, earners), where earners keeps each member's incomes apart for FICA.
+    """
+    incomes, assets, debts, retirement_accounts, insurances, earners = [], [], [], [], [], []
+    for _, member_incomes, member_assets, member_debts, member_accounts, member_insurances in portfolios:
+        incomes += member_incomes
+        assets += member_assets
+        debts += member_debts
+        retirement_accounts += member_accounts
+        insurances += member_insurances
+        earners.append(member_incomes)
+    return incomes, assets, debts, retirement_accounts, insurances, earners
@@ -0,0 +1,500 @@
+"""
+Local load test for the Flask API in api.py.
+
+Runs the real app in-process against an in-memory Firestore stand-in, a fake
+auth.verify_id_token (tokens are "loadtest:<uid>") and a replayable price
+provider with configurable latency, which replaces only the yfinance call so
+the price service's snapshot, single-flight and circuit breaker stay in the
+path. Requests are issued open-loop at a target rate across many synthetic
+users; latency is measured from each request's scheduled start, so a
+saturated app shows up as queueing delay rather than a lower send rate.
+
+The report is JSON: throughput, p50/p95/p99 latency and error rate per
+endpoint and overall. Pass an earlier report with --baseline to print the
+change in each figure.
+
+Usage: python load_test.py --rps 50 --duration 30 --users 200 --output report.json
+"""
+import argparse
+import copy
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+from google.cloud.firestore_v1.transforms import ArrayUnion, ArrayRemove, Sentinel
+
+DEFAULT_MIX = 'net_worth=60,portfolio=20,state_comparison=10,assets=10'
+SYNTHETIC_TICKERS = ['AAPL', 'MSFT', 'GOOG', 'AMZN', 'NVDA', 'META', 'TSLA', 'BRK-B', 'JPM', 'V', 'VTI', 'VOO', 'BND', 'AGG', 'QQQ', 'SCHD']
+
+class InMemoryFirestore:
+    """
+    The subset of the Firestore client used by firestore_db, backed by a dict
+    of document path -> data. Every call sleeps `latency` seconds to stand in
+    for a network round trip.
+    """
+    def __init__(self, latency=0.0):
+        self.documents = {}
+        # Document path -> write counter, standing in for update times
+        self.update_times = {}
+        self.writes = 0
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return _MemoryCollection(self, name)
+
+    def collection_group(self, name):
+        return _MemoryQuery(self, name, group=True)
+
+    def batch(self):
+        return _MemoryBatch(self)
+
+    def get_all(self, references):
+        self._round_trip()
+        with self.lock:
+            return [_MemorySnapshot(ref.id, copy.deepcopy(self.documents.get(ref.path)), ref, self.update_times.get(ref.path)) for ref in references]
+
+    def write_option(self, last_update_time):
+        return last_update_time
+
+    def _store(self, path, data):
+        """Writes or (data None) deletes a document; the caller holds the lock."""
+        self.writes += 1
+        if data is None:
+            self.documents.pop(path, None)
+            self.update_times.pop(path, None)
+        else:
+            self.documents[path] = data
+            self.update_times[path] = self.writes
+
+def _apply_fields(current, fields):
+    """Returns `current` updated with `fields`, applying ArrayUnion/ArrayRemove transforms."""
+    result = copy.deepcopy(current) if current else {}
+    for key, value in fields.items():
+        if isinstance(value, ArrayUnion):
+            existing = result.get(key, [])
+            result[key] = existing + [item for item in value.values if item not in existing]
+        elif isinstance(value, ArrayRemove):
+            result[key] = [item for item in result.get(key, []) if item not in value.values]
+        elif isinstance(value, Sentinel):
+            # DELETE_FIELD, the only sentinel firestore_db writes
+            result.pop(key, None)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+class _MemorySnapshot:
+    def __init__(self, doc_id, data, reference=None, update_time=None):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+        self.reference = reference
+        self.update_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+class _MemoryDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def get(self):
+        self.db._round_trip()
+        with self.db.lock:
+            return _MemorySnapshot(self.id, copy.deepcopy(self.db.documents.get(self.path)), self, self.db.update_times.get(self.path))
+
+    def set(self, data, merge=False):
+        self.db._round_trip()
+        with self.db.lock:
+            self.db._store(self.path, _apply_fields(self.db.documents.get(self.path) if merge else None, data))
+
+    def create(self, data):
+        self.db._round_trip()
+        with self.db.lock:
+            if self.path in self.db.documents:
+                raise AlreadyExists(self.path)
+            self.db._store(self.path, _apply_fields(None, data))
+
+    def update(self, data, option=None):
+        self.db._round_trip()
+        with self.db.lock:
+            if self.path not in self.db.documents or (option is not None and self.db.update_times.get(self.path) != option):
+                raise FailedPrecondition(self.path)
+            self.db._store(self.path, _apply_fields(self.db.documents[self.path], data))
+
+    def delete(self):
+        self.db._round_trip()
+        with self.db.lock:
+            self.db._store(self.path, None)
+
+    def collection(self, name):
+        return _MemoryCollection(self.db, f"{self.path}/{name}")
+
+class _MemoryQuery:
+    def __init__(self, db, path, group=False):
+        self.db = db
+        self.path = path
+        self.group = group
+        self.filters = []
+        self.after = None
+        self.max_results = None
+
+    def _derive(self, **changes):
+        query = copy.copy(self)
+        query.filters = list(self.filters)
+        query.__dict__.update(changes)
+        return query
+
+    def where(self, filter):
+        return self._derive(filters=self.filters + [filter])
+
+    def select(self, field_paths):
+        return self
+
+    def order_by(self, field_path):
+        # Results are always in document id order, the only ordering firestore_db asks for
+        return self
+
+    def start_after(self, values):
+        return self._derive(after=next(iter(values.values())))
+
+    def limit(self, count):
+        return self._derive(max_results=count)
+
+    def _matches(self, path):
+        parent, _, _ = path.rpartition('/')
+        if self.group:
+            return parent.rsplit('/', 1)[-1] == self.path
+        return parent == self.path
+
+    def stream(self):
+        self.db._round_trip()
+        with self.db.lock:
+            matches = sorted((path, data) for path, data in self.db.documents.items() if self._matches(path))
+            matches = [(path, copy.deepcopy(data)) for path, data in matches]
+        results = []
+        for path, data in matches:
+            doc_id = path.rsplit('/', 1)[-1]
+            if self.after is not None and doc_id <= self.after:
+                continue
+            if any(data.get(f.field_path) != f.value for f in self.filters):
+                continue
+            results.append(_MemorySnapshot(doc_id, data, _MemoryDocument(self.db, path), self.db.update_times.get(path)))
+            if self.max_results is not None and len(results) >= self.max_results:
+                break
+        return iter(results)
+
+class _MemoryCollection(_MemoryQuery):
+    def document(self, doc_id):
+        return _MemoryDocument(self.db, f"{self.path}/{doc_id}")
+
+class _MemoryBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref.path, copy.deepcopy(data)))
+
+    def delete(self, ref):
+        self.writes.append((ref.path, None))
+
+    def commit(self):
+        self.db._round_trip()
+        with self.db.lock:
+            for path, data in self.writes:
+                self.db._store(path, data)
+
+class ReplayPriceProvider:
+    """
+    Stands in for the yfinance lookup. Prices come from a recorded
+    {ticker: price or [prices...]} mapping, lists being replayed in order and
+    wrapping around; unknown tickers get a price derived from a seeded RNG, so
+    a run with the same seed sees the same quotes. Each call sleeps for
+    `latency` seconds plus up to `jitter`, and fails with probability `error_rate`.
+    """
+    def __init__(self, recorded=None, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.recorded = recorded or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+
+    def __call__(self, ticker):
+        with self.lock:
+            call = self.calls.get(ticker, 0)
+            self.calls[ticker] = call + 1
+            delay = self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+            fail = self.error_rate and self.rng.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            raise ConnectionError(f"Replayed upstream failure for {ticker}")
+        recorded = self.recorded.get(ticker)
+        if isinstance(recorded, list):
+            return recorded[call % len(recorded)] if recorded else None
+        if recorded is not None:
+            return recorded
+        return round(random.Random(f"{self.seed}:{ticker}").uniform(10, 500), 2)
+
+def synthetic_portfolio(rng):
+    """Returns a PUT /api/portfolio body for a random user."""
+    assets = []
+    for _ in range(rng.randint(3, 15)):
+        assets.append({'ticker': rng.choice(SYNTHETIC_TICKERS), 'shares': rng.randint(1, 200), 'cost_basis': rng.randint(500, 50000), 'asset_type': 'STOCK'})
+    assets.append({'asset_type': 'CASH', 'shares': rng.randint(1000, 50000)})
+    return {
+        'assets': assets,
+        'incomes': [{'income_type': 'ANNUAL_SALARY', 'yearly_income': rng.randint(40, 400) * 1000, 'year': 2026}],
+        'debts': [{'name': 'Car', 'initial_amount': 20000, 'amount_paid': rng.randint(0, 20000), 'monthly_payment': 400, 'interest_rate': 6.5}],
+        'retirement_accounts': [{'id': 'ra-1', 'name': '401k', 'account_type': 'K401', 'contributions_2025': 0, 'contributions_2026': rng.randint(0, 24500)}],
+        'insurances': [{'name': 'Health', 'amount': rng.randint(100, 600), 'frequency': 'MONTHLY'}]
+    }
+
+def endpoint_requests(rng):
+    """Maps endpoint name -> function(user_id) returning (method, path, json body)."""
+    return {
+        'net_worth': lambda uid: ('GET', '/api/net_worth', None),
+        'portfolio': lambda uid: ('PUT', '/api/portfolio', synthetic_portfolio(rng)),
+        'state_comparison': lambda uid: ('GET', '/api/state_comparison', None),
+        'assets': lambda uid: ('GET', '/api/assets?limit=50', None),
+        'user_tax_info': lambda uid: ('PUT', '/api/user_tax_info', {'filing_status': rng.choice(['SINGLE', 'MARRIED_FILING_JOINTLY'])})
+    }
+
+def parse_mix(mix):
+    """Parses 'name=weight,...' into {name: weight}."""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+def install_fakes(db, price_provider):
+    """Points the app at the in-memory Firestore, the fake token verifier and the replayed prices."""
+    import api
+    import auth
+    import firestore_db
+    import price_service
+
+    get_db = lambda: db
+    firestore_db.get_db = get_db
+    auth.get_db = get_db
+    api.get_db = get_db
+
+    def verify_id_token(id_token, *args, **kwargs):
+        prefix, _, uid = id_token.partition(':')
+        if prefix != 'loadtest' or not uid:
+            raise ValueError("Invalid load test token")
+        return {'uid': uid}
+    auth.auth.verify_id_token = verify_id_token
+
+    price_service._fetch_from_upstream = price_provider
+    # Generous limits: the harness measures the app, not the upstream protections
+    price_service._rate_limiter = price_service.RateLimiter(rate=1e9, burst=1e9)
+
+def seed_users(user_ids, rng):
+    """Stores a synthetic portfolio per user directly, so seeding costs no price lookups."""
+    from repository import save_user_data
+    from models import User, FilingStatus, USState
+    from portfolio_schema import parse_portfolio_payload
+
+    for uid in user_ids:
+        retirement_accounts, insurances, assets, incomes, debts = parse_portfolio_payload(synthetic_portfolio(rng))
+        user = User(filing_status=rng.choice([FilingStatus.SINGLE, FilingStatus.MARRIED_FILING_JOINTLY]), state=rng.choice(list(USState)))
+        save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id=uid)
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(samples, elapsed):
+    """Builds the per-endpoint and overall report sections from (endpoint, status, latency_s, service_s) samples."""
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups['overall'] = samples
+
+    summary = {}
+    for endpoint, group in groups.items():
+        latencies = sorted(s[2] * 1000 for s in group)
+        service_times = sorted(s[3] * 1000 for s in group)
+        errors = sum(1 for s in group if s[1] is None or s[1] >= 500)
+        statuses = {}
+        for s in group:
+            statuses[str(s[1])] = statuses.get(str(s[1]), 0) + 1
+        summary[endpoint] = {
+            'requests': len(group),
+            'throughput_rps': len(group) / elapsed if elapsed else 0.0,
+            'errors': errors,
+            'error_rate': errors / len(group) if group else 0.0,
+            'client_error_rate': sum(1 for s in group if s[1] is not None and 400 <= s[1] < 500) / len(group) if group else 0.0,
+            'status_counts': statuses,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) if latencies else None,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None
+            },
+            'service_time_ms': {
+                'p50': percentile(service_times, 50),
+                'p99': percentile(service_times, 99)
+            }
+        }
+    return summary
+
+def run(rps=20.0, duration=10.0, users=50, concurrency=32, mix=DEFAULT_MIX, price_latency_ms=50.0, price_jitter_ms=20.0, price_error_rate=0.0, firestore_latency_ms=5.0, recorded_prices=None, seed=1, database_url=None):
+    """Runs one load test and returns the report dict. With `database_url`, portfolios are stored by the SQL backend."""
+    import api
+    import price_service
+
+    rng = random.Random(seed)
+    db = InMemoryFirestore(latency=firestore_latency_ms / 1000)
+    provider = ReplayPriceProvider(recorded_prices, price_latency_ms / 1000, price_jitter_ms / 1000, price_error_rate, seed)
+    install_fakes(db, provider)
+    import repository
+    if database_url:
+        from sql_db import SQLRepository
+        repository.set_repository(SQLRepository(database_url))
+    else:
+        repository.set_repository(repository.FirestoreRepository())
+
+    user_ids = [f"user-{i:05d}" for i in range(users)]
+    seed_users(user_ids, rng)
+    upstream_calls_before = price_service.get_price_service_metrics()['upstream_calls']
+
+    weights = parse_mix(mix)
+    builders = endpoint_requests(rng)
+    unknown = set(weights) - set(builders)
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {', '.join(sorted(unknown))}")
+    names = list(weights)
+    schedule = []
+    for i in range(int(rps * duration)):
+        endpoint = rng.choices(names, weights=[weights[n] for n in names])[0]
+        uid = rng.choice(user_ids)
+        schedule.append((i / rps, endpoint, uid, builders[endpoint](uid)))
+
+    local = threading.local()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def issue(scheduled_at, endpoint, uid, request_spec):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = api.app.test_client()
+        method, path, body = request_spec
+        started = time.perf_counter()
+        try:
+            response = client.open(path, method=method, json=body, headers={'Authorization': f"Bearer loadtest:{uid}"})
+            status = response.status_code
+        except Exception:
+            status = None
+        finished = time.perf_counter()
+        with samples_lock:
+            samples.append((endpoint, status, finished - scheduled_at, finished - started))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, endpoint, uid, request_spec in schedule:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(issue, start + offset, endpoint, uid, request_spec)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'target_rps': rps,
+            'duration_s': duration,
+            'users': users,
+            'concurrency': concurrency,
+            'mix': weights,
+            'price_latency_ms': price_latency_ms,
+            'price_jitter_ms': price_jitter_ms,
+            'price_error_rate': price_error_rate,
+            'firestore_latency_ms': firestore_latency_ms,
+            'storage': 'sql' if database_url else 'firestore',
+            'seed': seed
+        },
+        'elapsed_s': elapsed,
+        'achieved_rps': len(samples) / elapsed if elapsed else 0.0,
+        'upstream_price_calls': price_service.get_price_service_metrics()['upstream_calls'] - upstream_calls_before,
+        'endpoints': summarize(samples, elapsed)
+    }
+
+def compare(report, baseline):
+    """Returns rows of (endpoint, metric, baseline, current, change %) for the headline figures."""
+    rows = []
+    for endpoint, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if previous is None:
+            continue
+        for metric, get in [('throughput_rps', lambda e: e['throughput_rps']), ('error_rate', lambda e: e['error_rate']),
+                            ('p50_ms', lambda e: e['latency_ms']['p50']), ('p95_ms', lambda e: e['latency_ms']['p95']), ('p99_ms', lambda e: e['latency_ms']['p99'])]:
+            before, after = get(previous), get(current)
+            change = (after - before) / before * 100 if before else None
+            rows.append((endpoint, metric, before, after, change))
+    return rows
+
+def print_report(report):
+    print(f"Target {report['config']['target_rps']} rps, achieved {report['achieved_rps']:.1f} rps over {report['elapsed_s']:.1f}s; {report['upstream_price_calls']} upstream price calls")
+    print(f"{'endpoint':<18} {'requests':>8} {'rps':>7} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in report['endpoints'].items():
+        latency = stats['latency_ms']
+        print(f"{endpoint:<18} {stats['requests']:>8} {stats['throughput_rps']:>7.1f} {stats['error_rate'] * 100:>6.2f} {latency['p50'] or 0:>8.1f} {latency['p95'] or 0:>8.1f} {latency['p99'] or 0:>8.1f}")
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.ERROR)
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rps', type=float, default=20.0, help="target requests per second")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of traffic")
+    parser.add_argument('--users', type=int, default=50, help="synthetic users")
+    parser.add_argument('--concurrency', type=int, default=32, help="requests in flight at most (like Functions concurrency)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"endpoint weights, default {DEFAULT_MIX}")
+    parser.add_argument('--price-latency-ms', type=float, default=50.0)
+    parser.add_argument('--price-jitter-ms', type=float, default=20.0)
+    parser.add_argument('--price-error-rate', type=float, default=0.0)
+    parser.add_argument('--firestore-latency-ms', type=float, default=5.0)
+    parser.add_argument('--prices', help="JSON file of recorded {ticker: price or [prices]} to replay")
+    parser.add_argument('--database-url', help="store portfolios with the SQL backend at this URL instead of the in-memory Firestore")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the JSON report here")
+    parser.add_argument('--baseline', help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    recorded = None
+    if args.prices:
+        with open(args.prices) as f:
+            recorded = json.load(f)
+    report = run(args.rps, args.duration, args.users, args.concurrency, args.mix, args.price_latency_ms, args.price_jitter_ms,
+                 args.price_error_rate, args.firestore_latency_ms, recorded, args.seed, args.database_url)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\n{'endpoint':<18} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+        for endpoint, metric, before, after, change in compare(report, baseline):
+            change_text = f"{change:+.1f}%" if change is not None else 'n/a'
+            print(f"{endpoint:<18} {metric:<15} {before if before is not None else 0:>10.2f} {after if after is not None else 0:>10.2f} {change_text:>8}")
@@ -1,8 +1,27 @@
 # Firebase Functions entry point
-from firebase_functions import https_fn
+from firebase_functions import https_fn, scheduler_fn
 
 @https_fn.on_request(region="us-west2")
 def api_func(req: https_fn.Request) -> https_fn.Response:
     import api
     with api.app.request_context(req.environ):
         return api.app.full_dispatch_request()
+
+@https_fn.on_request(region="us-west2")
+def api_async_func(req: https_fn.Request) -> https_fn.Response:
+    # Same URLs as api_func; only net worth, portfolio and tax info have async views, the rest are api's sync views
+    import async_api
+    with async_api.app.request_context(req.environ):
+        return async_api.app.full_dispatch_request()
+
+@scheduler_fn.on_schedule(schedule="every 5 minutes", region="us-west2")
+def prewarm_quotes(event: scheduler_fn.ScheduledEvent) -> None:
+    # Publishes the shared quote snapshot that get_current_price reads before going upstream
+    import price_service
+    price_service.prewarm_quote_snapshot()
+
+@scheduler_fn.on_schedule(schedule="every day 03:00", region="us-west2")
+def rebuild_held_tickers(event: scheduler_fn.ScheduledEvent) -> None:
+    # Drops tickers nobody holds any more from the registry the prewarmer reads
+    import firestore_db
+    firestore_db.rebuild_held_tickers()
@@ -0,0 +1,35 @@
+"""
+Moves every user document still in an older storage layout (incomes, assets
+and debts embedded as arrays, or keyed by position) to the current layout
+described in firestore_db.py. Safe to re-run: already migrated users are
+skipped, and get_user_data reads every layout while the migration is in
+progress.
+
+Usage: python migrate_storage.py [user_id ...]   (no arguments migrates everyone)
+"""
+import logging
+import sys
+from firestore_db import get_db, migrate_user_to_subcollections, LAYOUT_VERSION
+
+def legacy_user_ids():
+    """Yields the ids of users whose documents predate the current layout."""
+    db = get_db()
+    if db is None:
+        return
+    for doc in db.collection('users').select(['layout_version']).stream():
+        if (doc.to_dict() or {}).get('layout_version', 1) < LAYOUT_VERSION:
+            yield doc.id
+
+def run(user_ids=None):
+    migrated = 0
+    for user_id in user_ids or legacy_user_ids():
+        try:
+            if migrate_user_to_subcollections(user_id):
+                migrated += 1
+        except Exception as e:
+            logging.error(f"Failed to migrate user {user_id}: {e}")
+    return migrated
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f"Migrated {run(sys.argv[1:])} users to storage layout {LAYOUT_VERSION}")
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, Enum
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, Enum, Date, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import enum
@@ -66,7 +66,7 @@ class USState(enum.Enum):
 
 class User(Base):
     __tablename__ = 'users'
-    id = Column(Integer, primary_key=True)
+    id = Column(String, primary_key=True) # Firebase uid, the same key as the Firestore user document
     filing_status = Column(Enum(FilingStatus), nullable=False)
     state = Column(Enum(USState), nullable=False)
 
@@ -101,8 +101,10 @@ class AssetType(enum.Enum):
 
 class Income(Base):
     __tablename__ = 'incomes'
+    __table_args__ = (Index('ix_incomes_user_position', 'user_id', 'position', unique=True),)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=True)
+    user_id = Column(String, nullable=True)
+    position = Column(Integer, nullable=False, default=0) # Order within the user's list
     income_type = Column(Enum(IncomeType), nullable=False)
     hourly_type = Column(Enum(HourlyType), nullable=True, default=HourlyType.REPEATING)
     amount = Column(Float, nullable=False)
@@ -113,16 +115,19 @@ class Income(Base):
 
 class Insurance(Base):
     __tablename__ = 'insurances'
+    __table_args__ = (Index('ix_insurances_user_position', 'user_id', 'position', unique=True),)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=True)
+    user_id = Column(String, nullable=True)
+    position = Column(Integer, nullable=False, default=0) # Order within the user's list
     name = Column(String, nullable=False)
     amount = Column(Float, nullable=False)
     frequency = Column(Enum(InsuranceFrequency), nullable=False, default=InsuranceFrequency.MONTHLY)
 
 class RetirementAccount(Base):
     __tablename__ = 'retirement_accounts'
-    id = Column(Integer, primary_key=True) # Used for linking assets in valid SQL, effectively UUID in Firestore
-    user_id = Column(Integer, nullable=True)
+    user_id = Column(String, primary_key=True) # Leading key column, so lookups by user use the primary key index
+    id = Column(String, primary_key=True) # Client-provided or UUID string; assets link to it by retirement_account_id
+    position = Column(Integer, nullable=False, default=0) # Order within the user's list
     name = Column(String, nullable=False)
     account_type = Column(Enum(AccountType), nullable=False)
     contributions_2025 = Column(Float, nullable=False, default=0.0)
@@ -130,8 +135,10 @@ class RetirementAccount(Base):
 
 class Asset(Base):
     __tablename__ = 'assets'
+    __table_args__ = (Index('ix_assets_user_position', 'user_id', 'position', unique=True),)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=True)
+    user_id = Column(String, nullable=True)
+    position = Column(Integer, nullable=False, default=0) # Order within the user's list
     retirement_account_id = Column(String, nullable=True) # ID string to link to Firestore retirement account
     ticker = Column(String, nullable=False)
     shares = Column(Float, nullable=False)
@@ -140,8 +147,10 @@ class Asset(Base):
 
 class Debt(Base):
     __tablename__ = 'debts'
+    __table_args__ = (Index('ix_debts_user_position', 'user_id', 'position', unique=True),)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=True)
+    user_id = Column(String, nullable=True)
+    position = Column(Integer, nullable=False, default=0) # Order within the user's list
     name = Column(String, nullable=False)
     initial_amount = Column(Float, nullable=False)
     amount_paid = Column(Float, nullable=False, default=0.0)
@@ -152,6 +161,16 @@ class Debt(Base):
     def remaining_balance(self):
         return max(0, self.initial_amount - self.amount_paid)
 
+class TaxLot(Base):
+    __tablename__ = 'tax_lots'
+    id = Column(String, primary_key=True) # UUID string, also the Firestore document id
+    user_id = Column(String, nullable=True, index=True)
+    retirement_account_id = Column(String, nullable=True)
+    ticker = Column(String, nullable=False)
+    shares = Column(Float, nullable=False)
+    cost_basis = Column(Float, nullable=False) # Total cost of the lot, not per share
+    acquired = Column(Date, nullable=False)
+
 # Example of how to set up the database engine
 # engine = create_engine('sqlite:///finance.db')
 # Base.metadata.create_all(engine)
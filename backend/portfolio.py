@@ -0,0 +1,77 @@
+from models import Asset, AssetType, RetirementAccount
+
+# Asset types priced from the market; for every other type 'shares' holds the dollar value
+MARKET_ASSET_TYPES = [AssetType.STOCK, AssetType.BOND]
+
+UNASSIGNED_ACCOUNT = 'unassigned'
+
+def market_tickers(assets: list[Asset]):
+    """Returns the distinct tickers that need a market price, in portfolio order."""
+    return list(dict.fromkeys(a.ticker for a in assets if a.asset_type in MARKET_ASSET_TYPES))
+
+def asset_value(asset: Asset, prices: dict):
+    """Returns (market_value, cost_basis) for one asset, falling back to cost basis if unpriced."""
+    if asset.asset_type not in MARKET_ASSET_TYPES:
+        # Cash-like and housing entries store their value in 'shares' and carry no gain
+        return asset.shares, asset.shares
+    current_price = prices.get(asset.ticker)
+    if current_price is not None and current_price > 0:
+        return current_price * asset.shares, asset.cost_basis
+    return asset.cost_basis, asset.cost_basis
+
+def _new_bucket():
+    return {'market_value': 0.0, 'cost_basis': 0.0, 'count': 0}
+
+def _finish_buckets(buckets, total_market_value):
+    for bucket in buckets.values():
+        bucket['unrealized_gain'] = bucket['market_value'] - bucket['cost_basis']
+        bucket['unrealized_gain_pct'] = bucket['unrealized_gain'] / bucket['cost_basis'] * 100 if bucket['cost_basis'] > 0 else 0.0
+        bucket['allocation_pct'] = bucket['market_value'] / total_market_value * 100 if total_market_value > 0 else 0.0
+    return buckets
+
+def summarize_portfolio(assets: list[Asset], retirement_accounts: list[RetirementAccount] = [], prices: dict = {}):
+    """
+    Rolls the portfolio up by retirement account, asset type and ticker.
+    The three bucket maps are built together in one pass, with every asset
+    valued once, so the cost is linear in the number of assets regardless of
+    how many accounts, types or tickers there are.
+    """
+    by_account = {}
+    for ra in retirement_accounts:
+        by_account[ra.id] = dict(_new_bucket(), name=ra.name, account_type=ra.account_type.name)
+    by_type = {}
+    by_ticker = {}
+
+    total_market_value = 0.0
+    total_cost_basis = 0.0
+    for asset in assets:
+        market_value, cost_basis = asset_value(asset, prices)
+        total_market_value += market_value
+        total_cost_basis += cost_basis
+
+        account_id = getattr(asset, 'retirement_account_id', None) or UNASSIGNED_ACCOUNT
+        account_bucket = by_account.get(account_id)
+        if account_bucket is None:
+            account_bucket = by_account[account_id] = dict(_new_bucket(), name=None, account_type=None)
+        type_bucket = by_type.get(asset.asset_type.name)
+        if type_bucket is None:
+            type_bucket = by_type[asset.asset_type.name] = _new_bucket()
+        ticker_bucket = by_ticker.get(asset.ticker)
+        if ticker_bucket is None:
+            ticker_bucket = by_ticker[asset.ticker] = _new_bucket()
+
+        for bucket in (account_bucket, type_bucket, ticker_bucket):
+            bucket['market_value'] += market_value
+            bucket['cost_basis'] += cost_basis
+            bucket['count'] += 1
+
+    unrealized_gain = total_market_value - total_cost_basis
+    return {
+        'total_market_value': total_market_value,
+        'total_cost_basis': total_cost_basis,
+        'unrealized_gain': unrealized_gain,
+        'unrealized_gain_pct': unrealized_gain / total_cost_basis * 100 if total_cost_basis > 0 else 0.0,
+        'by_account': _finish_buckets(by_account, total_market_value),
+        'by_asset_type': _finish_buckets(by_type, total_market_value),
+        'by_ticker': _finish_buckets(by_ticker, total_market_value)
+    }
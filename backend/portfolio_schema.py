@@ -0,0 +1,237 @@
+"""
+Validation of PUT /api/portfolio payloads.
+
+The schema below is compiled once, at import, into per-field checker
+functions. A payload is then checked in a single pass with no I/O, and every
+problem is collected rather than stopping at the first one. Ticker existence
+is not checked here: the caller prices the distinct tickers afterwards, as one
+batch, and only for payloads that passed this stage.
+"""
+import math
+import uuid
+from models import Income, Asset, IncomeType, Debt, AssetType, RetirementAccount, AccountType, Insurance, InsuranceFrequency, HourlyType
+from portfolio import MARKET_ASSET_TYPES
+
+CASH_LIKE_ASSET_TYPES = [AssetType.CASH, AssetType.SAVINGS, AssetType.CHECKING, AssetType.HIGH_YIELD_SAVINGS]
+
+# Field specs: 'type' is 'string', 'number', 'integer' or an Enum class.
+# Missing optional fields take 'default'; numbers may set a 'minimum'.
+PORTFOLIO_SCHEMA = {
+    'retirement_accounts': {
+        'id': {'type': 'string'},
+        'name': {'type': 'string', 'required': True},
+        'account_type': {'type': AccountType, 'required': True},
+        'contributions_2025': {'type': 'number', 'default': 0.0},
+        'contributions_2026': {'type': 'number', 'default': 0.0}
+    },
+    'insurances': {
+        'name': {'type': 'string', 'required': True},
+        'amount': {'type': 'number', 'default': 0.0},
+        'frequency': {'type': InsuranceFrequency, 'required': True}
+    },
+    'assets': {
+        'ticker': {'type': 'string', 'default': ''},
+        'asset_type': {'type': AssetType, 'default': 'STOCK'},
+        'shares': {'type': 'number', 'default': 0.0, 'minimum': 0},
+        'cost_basis': {'type': 'number', 'default': 0.0, 'minimum': 0},
+        'retirement_account_id': {'type': 'string'}
+    },
+    'incomes': {
+        'income_type': {'type': IncomeType, 'required': True},
+        'year': {'type': 'integer', 'default': 2026},
+        'yearly_income': {'type': 'number', 'default': 0.0},
+        'monthly_income': {'type': 'number', 'default': 0.0},
+        'hourly_wage': {'type': 'number', 'default': 0.0},
+        'hours_worked': {'type': 'number', 'default': 0.0},
+        'hourly_type': {'type': HourlyType, 'default': 'REPEATING'}
+    },
+    'debts': {
+        'name': {'type': 'string', 'required': True},
+        'initial_amount': {'type': 'number', 'default': 0.0, 'minimum': 0},
+        'amount_paid': {'type': 'number', 'default': 0.0, 'minimum': 0},
+        'monthly_payment': {'type': 'number', 'default': 0.0},
+        'interest_rate': {'type': 'number', 'default': 0.0}
+    }
+}
+
+class PortfolioValidationError(ValueError):
+    """Raised when a portfolio payload contains invalid values. `errors` lists every problem found."""
+    def __init__(self, errors):
+        self.errors = errors if isinstance(errors, list) else [{'field': None, 'message': errors}]
+        super().__init__(self.errors[0]['message'])
+
+def _compile_field(name, spec):
+    """Returns check(entry, path, errors) -> coerced value, appending to `errors` on failure."""
+    kind = spec['type']
+    required = spec.get('required', False)
+    default = spec.get('default')
+    minimum = spec.get('minimum')
+
+    if kind == 'string':
+        def convert(value):
+            if not isinstance(value, str):
+                raise ValueError("must be a string")
+            return value
+    elif kind == 'number':
+        def convert(value):
+            if isinstance(value, bool):
+                raise ValueError("must be a number")
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                raise ValueError("must be a number")
+            if not math.isfinite(number):
+                raise ValueError("must be a finite number")
+            if minimum is not None and number < minimum:
+                raise ValueError("must be positive")
+            return number
+    elif kind == 'integer':
+        def convert(value):
+            try:
+                if isinstance(value, bool):
+                    raise TypeError
+                return int(value)
+            except (TypeError, ValueError):
+                raise ValueError("must be a whole number")
+    else:
+        members = kind.__members__
+        choices = ', '.join(members)
+        def convert(value):
+            if value not in members:
+                raise ValueError(f"must be one of {choices}")
+            return members[value]
+        if default is not None:
+            default = members[default]
+
+    def check(entry, path, errors):
+        value = entry.get(name)
+        if value is None:
+            if required:
+                errors.append({'field': f"{path}.{name}", 'message': f"{path}.{name} is required."})
+            return default
+        try:
+            return convert(value)
+        except ValueError as e:
+            errors.append({'field': f"{path}.{name}", 'message': f"{path}.{name} {e}."})
+            return default
+    return check
+
+def compile_schema(schema):
+    """Compiles a section -> field spec mapping into section -> [(field name, checker)]."""
+    return {
+        section: [(name, _compile_field(name, spec)) for name, spec in fields.items()]
+        for section, fields in schema.items()
+    }
+
+_COMPILED_SCHEMA = compile_schema(PORTFOLIO_SCHEMA)
+
+def _build_retirement_account(values):
+    return RetirementAccount(
+        id=values['id'] or str(uuid.uuid4()),
+        name=values['name'],
+        account_type=values['account_type'],
+        contributions_2025=values['contributions_2025'],
+        contributions_2026=values['contributions_2026']
+    )
+
+def _build_insurance(values):
+    return Insurance(name=values['name'], amount=values['amount'], frequency=values['frequency'])
+
+def _check_asset(values, path, errors):
+    if values['asset_type'] in MARKET_ASSET_TYPES and not values['ticker'].strip():
+        errors.append({'field': f"{path}.ticker", 'message': "Ticker is required for stocks and bonds."})
+
+# Cross-field rules, run in the same pass once an entry's fields are individually valid
+_RULES = {'assets': _check_asset}
+
+def _build_asset(values):
+    ticker = values['ticker'].upper()
+    asset_type = values['asset_type']
+    shares = values['shares']
+    cost_basis = values['cost_basis']
+    if asset_type in CASH_LIKE_ASSET_TYPES:
+        ticker = asset_type.name
+        cost_basis = 1.0
+    elif asset_type == AssetType.HOUSING:
+        if not ticker:
+            ticker = 'PRIMARY RESIDENCE'
+        cost_basis = shares
+
+    asset = Asset(ticker=ticker, shares=shares, cost_basis=cost_basis, asset_type=asset_type)
+    if values['retirement_account_id'] is not None:
+        asset.retirement_account_id = values['retirement_account_id']
+    return asset
+
+def _build_income(values):
+    income_type = values['income_type']
+    income = Income(income_type=income_type)
+    income.year = values['year']
+    amount = 0
+    if income_type == IncomeType.ANNUAL_SALARY:
+        amount = values['yearly_income']
+        income.monthly_income = amount / 12
+    elif income_type == IncomeType.MONTHLY_SALARY:
+        income.monthly_income = values['monthly_income']
+        amount = income.monthly_income * 12
+    elif income_type == IncomeType.HOURLY:
+        income.hourly_type = values['hourly_type']
+        income.hourly_wage = values['hourly_wage']
+        income.hours_worked = values['hours_worked']
+        if income.hourly_type == HourlyType.REPEATING:
+            amount = income.hourly_wage * income.hours_worked * 52
+        else: # ONE_TIME
+            amount = income.hourly_wage * income.hours_worked
+    income.amount = max(0, amount)
+    return income
+
+def _build_debt(values):
+    return Debt(
+        name=values['name'] or 'Unnamed Debt',
+        initial_amount=values['initial_amount'],
+        amount_paid=values['amount_paid'],
+        monthly_payment=values['monthly_payment'],
+        interest_rate=values['interest_rate']
+    )
+
+_BUILDERS = {
+    'retirement_accounts': _build_retirement_account,
+    'insurances': _build_insurance,
+    'assets': _build_asset,
+    'incomes': _build_income,
+    'debts': _build_debt
+}
+
+def parse_portfolio_payload(data):
+    """
+    Builds model objects from a PUT /api/portfolio payload without any I/O.
+    Returns (retirement_accounts, insurances, assets, incomes, debts).
+    Raises PortfolioValidationError listing every invalid field.
+    """
+    if not isinstance(data, dict):
+        raise PortfolioValidationError("Portfolio must be a JSON object.")
+    errors = []
+    sections = {}
+    for section, checkers in _COMPILED_SCHEMA.items():
+        entries = data.get(section) or []
+        if not isinstance(entries, list):
+            errors.append({'field': section, 'message': f"{section} must be a list."})
+            continue
+        rule = _RULES.get(section)
+        checked = []
+        for position, entry in enumerate(entries):
+            path = f"{section}[{position}]"
+            if not isinstance(entry, dict):
+                errors.append({'field': path, 'message': f"{path} must be an object."})
+                continue
+            error_count = len(errors)
+            values = {name: check(entry, path, errors) for name, check in checkers}
+            if rule is not None and len(errors) == error_count:
+                rule(values, path, errors)
+            checked.append(values)
+        sections[section] = checked
+
+    if errors:
+        raise PortfolioValidationError(errors)
+    # Model objects are only built for a payload that passed, so rejections stay cheap
+    built = {section: [_BUILDERS[section](values) for values in checked] for section, checked in sections.items()}
+    return built['retirement_accounts'], built['insurances'], built['assets'], built['incomes'], built['debts']
@@ -1,32 +1,326 @@
-def get_current_price(ticker_symbol):
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Upstream (yfinance) protection settings
+BREAKER_FAILURE_THRESHOLD = 5   # consecutive upstream errors before the breaker opens
+BREAKER_RESET_TIMEOUT = 30.0    # seconds to stay open before letting a trial request through
+UPSTREAM_RATE_PER_SECOND = 10.0 # sustained upstream calls per second
+UPSTREAM_BURST = 20             # upstream calls allowed back-to-back
+
+# Shared quote snapshot published by the scheduled prewarmer
+SNAPSHOT_REFRESH_INTERVAL = 60.0 # seconds between snapshot reads on one instance
+SNAPSHOT_MAX_AGE = 15 * 60       # snapshot quotes older than this are not served
+PREWARM_BATCH_SIZE = 200         # tickers per bulk download
+VALIDATION_WORKERS = 8           # concurrent lookups when validating a batch of tickers
+QUOTE_CACHE_TTL = 60.0           # seconds an instance reuses a quote it fetched itself
+
+# Returned by get_quote when the upstream could not be asked (rate limited, breaker
+# open or failing) and no earlier price is known: the ticker is unverified, not invalid
+UNAVAILABLE = object()
+
+class CircuitBreaker:
     """
-    Fetches the current market price for a given ticker symbol using yfinance.
-    Returns None if ticker is invalid or data cannot be fetched.
+    Stops calling a failing upstream. After `failure_threshold` consecutive
+    errors the breaker opens and requests are refused; once `reset_timeout`
+    has passed a single trial request is let through (half-open), and its
+    outcome closes or re-opens the breaker.
     """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                if self.state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _transition(self, state):
+        logging.warning(f"Price upstream circuit breaker: {self.state} -> {state}")
+        self.state = state
+
+class RateLimiter:
+    """Token bucket limiting how fast the upstream is called."""
+    def __init__(self, rate=UPSTREAM_RATE_PER_SECOND, burst=UPSTREAM_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+_breaker = CircuitBreaker()
+_rate_limiter = RateLimiter()
+_last_known_prices = {}
+_quote_cache = {} # ticker -> (price, fetched_at)
+_inflight = {}
+_inflight_lock = threading.Lock()
+_snapshot = {'prices': {}, 'updated_at': 0.0, 'loaded_at': None}
+_snapshot_lock = threading.Lock()
+_metrics = {
+    'requests': 0,
+    'snapshot_hits': 0,
+    'cache_hits': 0,
+    'upstream_calls': 0,
+    'upstream_errors': 0,
+    'coalesced': 0,
+    'short_circuited': 0,
+    'rate_limited': 0
+}
+
+def _count(metric):
+    with _inflight_lock:
+        _metrics[metric] += 1
+
+def _fetch_from_upstream(ticker_symbol):
+    """Fetches the latest close from yfinance. Returns None for unknown tickers; raises on upstream errors."""
     import yfinance as yf
-    
-    if not ticker_symbol or ticker_symbol == 'CASH':
-        return 1.0
+    from yfinance.exceptions import YFTickerMissingError
 
+    ticker = yf.Ticker(ticker_symbol)
+    # Fetching info is a better way to check if ticker exists
+    # but it's slow. history is usually enough.
+    # Make network/rate-limit failures raise instead of returning an empty frame
+    yf.config.debug.hide_exceptions = False
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        # Fetching info is a better way to check if ticker exists
-        # but it's slow. history is usually enough.
         todays_data = ticker.history(period='1d')
-        if not todays_data.empty:
-            return float(todays_data['Close'].iloc[-1])
-        else:
-            return None
+    except YFTickerMissingError:
+        return None
+    if not todays_data.empty:
+        return float(todays_data['Close'].iloc[-1])
+    return None
+
+def _fetch_guarded(ticker_symbol):
+    """
+    Calls the upstream through the breaker and rate limiter. Returns the price,
+    None for an unknown ticker, or when refused the last known price or UNAVAILABLE.
+    """
+    if not _breaker.allow_request():
+        _count('short_circuited')
+        return _last_known_prices.get(ticker_symbol, UNAVAILABLE)
+    if not _rate_limiter.try_acquire():
+        _count('rate_limited')
+        return _last_known_prices.get(ticker_symbol, UNAVAILABLE)
+
+    _count('upstream_calls')
+    try:
+        price = _fetch_from_upstream(ticker_symbol)
     except Exception as e:
-        print(f"Error fetching price for {ticker_symbol}: {e}")
+        _count('upstream_errors')
+        _breaker.record_failure()
+        logging.warning(f"Error fetching price for {ticker_symbol}: {e}")
+        return _last_known_prices.get(ticker_symbol, UNAVAILABLE)
+
+    _breaker.record_success()
+    if price is not None:
+        _last_known_prices[ticker_symbol] = price
+        _quote_cache[ticker_symbol] = (price, time.monotonic())
+    return price
+
+def _snapshot_price(ticker_symbol):
+    """Returns the ticker's price from the shared quote snapshot if it is fresh, else None."""
+    now = time.time()
+    with _snapshot_lock:
+        reload = _snapshot['loaded_at'] is None or now - _snapshot['loaded_at'] >= SNAPSHOT_REFRESH_INTERVAL
+        if reload:
+            # Claim the reload so other threads keep using the current snapshot meanwhile
+            _snapshot['loaded_at'] = now
+    if reload:
+        from firestore_db import get_quote_snapshot
+        try:
+            snapshot = get_quote_snapshot()
+        except Exception as e:
+            logging.warning(f"Failed to load quote snapshot: {e}")
+            snapshot = None
+        if snapshot:
+            with _snapshot_lock:
+                _snapshot['prices'] = snapshot.get('prices', {})
+                _snapshot['updated_at'] = snapshot.get('updated_at', 0.0)
+
+    if now - _snapshot['updated_at'] > SNAPSHOT_MAX_AGE:
         return None
+    return _snapshot['prices'].get(ticker_symbol)
+
+def get_quote(ticker_symbol):
+    """
+    Looks up a ticker's current price. Returns the price, None if the ticker
+    does not exist, or UNAVAILABLE if it could not be checked.
+    The shared quote snapshot is consulted first, then quotes this instance
+    fetched in the last QUOTE_CACHE_TTL seconds. Concurrent requests for the
+    same ticker share one upstream call, and while the upstream is failing or
+    rate limited the last known price is returned.
+    """
+    if not ticker_symbol or ticker_symbol == 'CASH':
+        return 1.0
+
+    price = _snapshot_price(ticker_symbol)
+    if price is not None:
+        _count('snapshot_hits')
+        return price
+
+    cached = _quote_cache.get(ticker_symbol)
+    if cached is not None and time.monotonic() - cached[1] < QUOTE_CACHE_TTL:
+        _count('cache_hits')
+        return cached[0]
+
+    with _inflight_lock:
+        _metrics['requests'] += 1
+        future = _inflight.get(ticker_symbol)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[ticker_symbol] = future
+        else:
+            _metrics['coalesced'] += 1
+
+    if not is_leader:
+        return future.result()
+
+    price = UNAVAILABLE
+    try:
+        price = _fetch_guarded(ticker_symbol)
+    finally:
+        with _inflight_lock:
+            del _inflight[ticker_symbol]
+        future.set_result(price)
+    return price
+
+def get_current_price(ticker_symbol):
+    """
+    Fetches the current market price for a given ticker symbol using yfinance.
+    Returns None if ticker is invalid or data cannot be fetched.
+    """
+    price = get_quote(ticker_symbol)
+    return None if price is UNAVAILABLE else price
+
+def get_prices(ticker_symbols):
+    """Fetches each distinct ticker once. Returns {ticker: price or None}."""
+    return {ticker: get_current_price(ticker) for ticker in dict.fromkeys(ticker_symbols)}
+
+def fetch_bulk_prices(ticker_symbols, batch_size=PREWARM_BATCH_SIZE):
+    """Prices many tickers with batched yfinance downloads. Tickers without data are left out."""
+    import yfinance as yf
+
+    tickers = sorted(set(ticker_symbols))
+    prices = {}
+    for start in range(0, len(tickers), batch_size):
+        batch = tickers[start:start + batch_size]
+        try:
+            data = yf.download(batch, period='5d', progress=False, threads=True, auto_adjust=True)
+        except Exception as e:
+            logging.warning(f"Bulk price download failed for {len(batch)} tickers: {e}")
+            continue
+        if data.empty:
+            continue
+        closes = data['Close']
+        if not hasattr(closes, 'columns'):
+            closes = closes.to_frame(name=batch[0])
+        last_closes = closes.ffill().iloc[-1]
+        for ticker in batch:
+            if ticker in last_closes.index and last_closes[ticker] == last_closes[ticker]:  # skip NaN
+                prices[ticker] = float(last_closes[ticker])
+    return prices
+
+def prewarm_quote_snapshot():
+    """
+    Prices every ticker held by any user in bulk and publishes the result as
+    the shared quote snapshot. Run on a schedule so instances rarely need to
+    go upstream themselves. Returns the number of tickers priced.
+    """
+    from firestore_db import get_all_held_tickers, save_quote_snapshot
+
+    tickers = get_all_held_tickers()
+    if not tickers:
+        return 0
+    prices = fetch_bulk_prices(tickers)
+    if prices:
+        save_quote_snapshot(prices, time.time())
+        _last_known_prices.update(prices)
+    logging.info(f"Quote snapshot prewarmed: {len(prices)}/{len(tickers)} tickers priced")
+    return len(prices)
+
+def is_upstream_available():
+    """False while the circuit breaker is refusing upstream calls."""
+    return _breaker.state == CircuitBreaker.CLOSED
 
 def validate_ticker(ticker_symbol):
-    """Returns True if ticker is valid, False otherwise."""
+    """Returns False only for tickers the upstream reports as unknown; unverifiable tickers are accepted."""
     if ticker_symbol == 'CASH':
         return True
-    price = get_current_price(ticker_symbol)
-    return price is not None
+    return get_quote(ticker_symbol) is not None
+
+def validate_tickers(ticker_symbols):
+    """
+    Checks many tickers as one batch: each distinct ticker is priced once, concurrently.
+    Returns (prices, invalid_tickers). Only tickers the upstream reports as unknown
+    are invalid; tickers that could not be checked (rate limited, upstream down)
+    are accepted and priced None.
+    """
+    tickers = list(dict.fromkeys(ticker_symbols))
+    if len(tickers) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(tickers), VALIDATION_WORKERS)) as pool:
+            quotes = dict(zip(tickers, pool.map(get_quote, tickers)))
+    else:
+        quotes = {ticker: get_quote(ticker) for ticker in tickers}
+    invalid = [ticker for ticker, price in quotes.items() if price is None]
+    prices = {ticker: None if price is UNAVAILABLE else price for ticker, price in quotes.items()}
+    return prices, invalid
+
+def get_price_service_metrics():
+    """Returns breaker state and upstream counters."""
+    return dict(
+        _metrics,
+        breaker_state=_breaker.state,
+        consecutive_failures=_breaker.consecutive_failures,
+        last_known_prices=len(_last_known_prices),
+        cached_quotes=len(_quote_cache),
+        snapshot_tickers=len(_snapshot['prices']),
+        snapshot_age=time.time() - _snapshot['updated_at'] if _snapshot['updated_at'] else None,
+        in_flight=len(_inflight)
+    )
 
 if __name__ == '__main__':
     # Example usage:
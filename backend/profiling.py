@@ -0,0 +1,228 @@
+"""
+Opt-in statistical profiling of individual API requests.
+
+A request is profiled when it carries `X-Profile-Token` matching the
+PROFILE_ADMIN_TOKEN environment variable, or when it is picked by
+PROFILE_SAMPLE_RATE (0..1, default 0). While the handler runs, a sampler
+thread records the handler thread's stack every PROFILE_INTERVAL_MS
+milliseconds; the stacks are stored as collapsed stacks (flamegraph.pl /
+speedscope import) or speedscope JSON, chosen with the `X-Profile` header or
+PROFILE_FORMAT, under a profile id generated here and returned in the
+`X-Profile-Id` response header. A caller's `X-Request-Id` is only recorded
+alongside it. Profiles are rendered and stored by a background thread, so
+the response is not held up by the writes.
+
+When neither trigger is configured the hooks return after one comparison,
+so unprofiled requests pay essentially nothing.
+"""
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from flask import g, request
+
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '1'))
+PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'collapsed')
+PROFILE_DIR = os.environ.get('PROFILE_DIR') # also write profiles here, handy without Firestore
+PROFILE_FORMATS = ['collapsed', 'speedscope']
+MAX_STACK_DEPTH = 128
+MAX_PROFILE_BYTES = 900 * 1024 # under the Firestore document limit
+PROFILE_QUEUE_SIZE = 100 # profiles waiting to be stored; more are dropped
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+_store_queue = queue.Queue(maxsize=PROFILE_QUEUE_SIZE)
+_store_thread = None
+_store_lock = threading.Lock()
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread until stopped."""
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = [] # (stack tuple, root first; seconds since the previous sample)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((tuple(stack), now - last))
+            last = now
+
+def _frame_label(frame):
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def to_collapsed(samples):
+    """Folds samples into 'root;...;leaf count' lines, heaviest first."""
+    counts = {}
+    for stack, _ in samples:
+        key = ';'.join(_frame_label(frame) for frame in stack)
+        counts[key] = counts.get(key, 0) + 1
+    return '\n'.join(f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+def to_speedscope(samples, name, duration):
+    """Builds a speedscope 'sampled' profile weighted by the time between samples, in milliseconds."""
+    frame_index = {}
+    frames = []
+    indexed_samples = []
+    weights = []
+    for stack, elapsed in samples:
+        indexed = []
+        for frame in stack:
+            position = frame_index.get(frame)
+            if position is None:
+                position = frame_index[frame] = len(frames)
+                frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            indexed.append(position)
+        indexed_samples.append(indexed)
+        weights.append(elapsed * 1000)
+    return json.dumps({
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'profiling.py',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': duration * 1000,
+            'samples': indexed_samples,
+            'weights': weights
+        }]
+    })
+
+def is_admin(token):
+    return bool(PROFILE_ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+def _should_profile():
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    return PROFILE_ADMIN_TOKEN and is_admin(request.headers.get('X-Profile-Token'))
+
+def start_profiling():
+    """before_request hook."""
+    if not PROFILE_ADMIN_TOKEN and not PROFILE_SAMPLE_RATE:
+        return
+    if request.path.startswith('/api/admin/') or not _should_profile():
+        return
+    requested_format = request.headers.get('X-Profile')
+    g.profile_format = requested_format if requested_format in PROFILE_FORMATS else PROFILE_FORMAT
+    # The stored profile is keyed by an id generated here, so no caller can overwrite another's
+    g.profile_id = uuid.uuid4().hex
+    request_id = request.headers.get('X-Request-Id', '')
+    g.profile_request_id = request_id if _REQUEST_ID_RE.match(request_id) else g.profile_id
+    g.profile_sampler = StackSampler(threading.get_ident())
+    g.profile_sampler.start()
+
+def finish_profiling(response):
+    """after_request hook: stops the sampler, queues the profile for storage and tags the response."""
+    sampler = g.pop('profile_sampler', None)
+    if sampler is None:
+        return response
+    sampler.stop()
+    record = {
+        'profile_id': g.profile_id,
+        'request_id': g.profile_request_id,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': sampler.duration * 1000,
+        'samples': len(sampler.samples),
+        'created_at': time.time()
+    }
+    _queue_profile(record, sampler, g.profile_format)
+    response.headers['X-Request-Id'] = g.profile_request_id
+    response.headers['X-Profile-Id'] = g.profile_id
+    return response
+
+def render_profile(record, sampler, profile_format):
+    """Adds the rendered profile and its format to a profile record."""
+    name = f"{record['method']} {record['path']}"
+    profile = to_speedscope(sampler.samples, name, sampler.duration) if profile_format == 'speedscope' else None
+    if profile is None or len(profile) > MAX_PROFILE_BYTES:
+        profile_format = 'collapsed'
+        profile = to_collapsed(sampler.samples)
+        if len(profile) > MAX_PROFILE_BYTES:
+            # Collapsed output is heaviest first, so truncating keeps the stacks that matter
+            profile = profile[:profile.rfind('\n', 0, MAX_PROFILE_BYTES)]
+    record['format'] = profile_format
+    record['profile'] = profile
+    return record
+
+def _queue_profile(record, sampler, profile_format):
+    global _store_thread
+    if _store_thread is None:
+        with _store_lock:
+            if _store_thread is None:
+                _store_thread = threading.Thread(target=_store_worker, name='profile-writer', daemon=True)
+                _store_thread.start()
+    try:
+        _store_queue.put_nowait((record, sampler, profile_format))
+    except queue.Full:
+        logging.warning(f"Dropped profile {record['profile_id']}: {PROFILE_QUEUE_SIZE} profiles already waiting to be stored")
+
+def _store_worker():
+    while True:
+        record, sampler, profile_format = _store_queue.get()
+        try:
+            store_profile(render_profile(record, sampler, profile_format))
+        except Exception as e:
+            logging.warning(f"Failed to store profile {record['profile_id']}: {e}")
+        finally:
+            _store_queue.task_done()
+
+def stop_on_error(exc):
+    """teardown_request hook: makes sure a failed request does not leave its sampler running."""
+    sampler = g.pop('profile_sampler', None)
+    if sampler is not None:
+        sampler.stop()
+
+def store_profile(record):
+    from firestore_db import save_request_profile
+    try:
+        save_request_profile(record)
+    except Exception as e:
+        logging.warning(f"Failed to save profile {record['profile_id']}: {e}")
+    if PROFILE_DIR:
+        extension = 'speedscope.json' if record['format'] == 'speedscope' else 'collapsed.txt'
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{record['profile_id']}.{extension}"), 'w') as f:
+            f.write(record['profile'])
+
+def install_profiler(app):
+    """Registers the profiling hooks on a Flask app. The profiler must be the first after_request hook
+    registered so that it runs last, after response encoding."""
+    app.before_request(start_profiling)
+    app.after_request(finish_profiling)
+    app.teardown_request(stop_on_error)
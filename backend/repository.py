@@ -0,0 +1,117 @@
+"""
+Storage backends for user portfolios.
+
+The API reads and writes portfolios through the module-level functions below,
+which delegate to the backend chosen by the STORAGE_BACKEND environment
+variable: 'firestore' (default, see firestore_db.py) or 'sql' (see sql_db.py,
+configured by DATABASE_URL). Tax lots, transaction imports, households and
+the quote snapshot remain Firestore-only.
+"""
+import os
+import threading
+import firestore_db
+
+class PortfolioRepository:
+    """Interface shared by the storage backends. Implementations must be safe to use from several threads."""
+    def get_user_data(self, user_id="default_user"):
+        """Returns (user, incomes, assets, debts, retirement_accounts, insurances); an empty portfolio if the user is unknown."""
+        raise NotImplementedError
+
+    def save_user_data(self, user, incomes, assets, debts, retirement_accounts, insurances, user_id="default_user"):
+        """Replaces the user's stored portfolio."""
+        raise NotImplementedError
+
+    def save_user_profile(self, user, user_id="default_user"):
+        """Saves only the filing status and state. Backends that can update them in place override this."""
+        _, incomes, assets, debts, retirement_accounts, insurances = self.get_user_data(user_id=user_id)
+        self.save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id=user_id)
+
+    def list_user_items(self, collection, user_id="default_user", limit=50, cursor=None):
+        """Returns (items, next_cursor) for one page of 'incomes', 'assets' or 'debts'."""
+        raise NotImplementedError
+
+    def get_user_profile(self, user_id="default_user"):
+        """Returns (user, retirement_accounts, insurances) without reading incomes, assets or debts."""
+        user, _, _, _, retirement_accounts, insurances = self.get_user_data(user_id=user_id)
+        return user, retirement_accounts, insurances
+
+    def get_users_data(self, user_ids):
+        """Returns {user_id: get_user_data(user_id)} for several users. Backends with batched reads override this."""
+        return {user_id: self.get_user_data(user_id=user_id) for user_id in user_ids}
+
+    def iter_user_items(self, collection, user_id="default_user", page_size=500):
+        """Yields every item of 'incomes', 'assets' or 'debts' as lists of at most page_size, one page in memory at a time."""
+        cursor = None
+        while True:
+            items, cursor = self.list_user_items(collection, user_id=user_id, limit=page_size, cursor=cursor)
+            if items:
+                yield items
+            if cursor is None:
+                return
+
+class FirestoreRepository(PortfolioRepository):
+    def get_user_data(self, user_id="default_user"):
+        return firestore_db.get_user_data(user_id=user_id)
+
+    def save_user_data(self, user, incomes, assets, debts, retirement_accounts, insurances, user_id="default_user"):
+        return firestore_db.save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id=user_id)
+
+    def save_user_profile(self, user, user_id="default_user"):
+        return firestore_db.save_user_profile(user, user_id=user_id)
+
+    def list_user_items(self, collection, user_id="default_user", limit=50, cursor=None):
+        return firestore_db.list_user_items(collection, user_id=user_id, limit=limit, cursor=cursor)
+
+    def get_user_profile(self, user_id="default_user"):
+        return firestore_db.get_user_profile(user_id=user_id)
+
+    def get_users_data(self, user_ids):
+        return firestore_db.get_users_data(user_ids)
+
+    def iter_user_items(self, collection, user_id="default_user", page_size=500):
+        return firestore_db.iter_user_items(collection, user_id=user_id, page_size=page_size)
+
+_repository = None
+_repository_lock = threading.Lock()
+
+def get_repository():
+    """Returns the process-wide repository, creating it from the environment on first use."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                backend = os.environ.get('STORAGE_BACKEND', 'firestore')
+                if backend == 'sql':
+                    from sql_db import SQLRepository
+                    _repository = SQLRepository(os.environ.get('DATABASE_URL', 'sqlite:///finance.db'))
+                elif backend == 'firestore':
+                    _repository = FirestoreRepository()
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return _repository
+
+def set_repository(repository):
+    """Replaces the process-wide repository (e.g. for a self-hosted entry point or a load test)."""
+    global _repository
+    _repository = repository
+
+def get_user_data(user_id="default_user"):
+    return get_repository().get_user_data(user_id=user_id)
+
+def save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id="default_user"):
+    return get_repository().save_user_data(user, incomes, assets, debts, retirement_accounts, insurances, user_id=user_id)
+
+def save_user_profile(user, user_id="default_user"):
+    return get_repository().save_user_profile(user, user_id=user_id)
+
+def list_user_items(collection, user_id="default_user", limit=50, cursor=None):
+    return get_repository().list_user_items(collection, user_id=user_id, limit=limit, cursor=cursor)
+
+def get_user_profile(user_id="default_user"):
+    return get_repository().get_user_profile(user_id=user_id)
+
+def get_users_data(user_ids):
+    return get_repository().get_users_data(user_ids)
+
+def iter_user_items(collection, user_id="default_user", page_size=500):
+    return get_repository().iter_user_items(collection, user_id=user_id, page_size=page_size)
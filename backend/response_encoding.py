@@ -0,0 +1,73 @@
+"""
+Content negotiation for API responses.
+
+JSON responses can be re-encoded as MessagePack (same schema) when the client
+asks for it in `Accept`, and compressed with brotli or gzip according to
+`Accept-Encoding`. Bodies under COMPRESSION_THRESHOLD bytes are sent
+uncompressed, since the headers and CPU cost outweigh the savings.
+"""
+import gzip
+import json
+from flask import request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_THRESHOLD = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # favours speed; dynamic responses are compressed on every request
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+def encode_msgpack(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def available_encodings():
+    """Content codings this instance can produce, best first."""
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+def choose_content_encoding(accept_encodings):
+    """Picks the best coding the client accepts, or None."""
+    for encoding in available_encodings():
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+def negotiate_response(response):
+    """
+    Flask after_request hook applying MessagePack and compression.
+    Streamed and non-JSON responses are passed through untouched.
+    """
+    if response.is_streamed or response.direct_passthrough or response.mimetype != 'application/json':
+        return response
+    if response.headers.get('Content-Encoding'):
+        return response
+
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+
+    wants_msgpack = msgpack is not None and request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+    if wants_msgpack:
+        body = encode_msgpack(json.loads(body))
+        response.mimetype = MSGPACK_MIMETYPE
+
+    encoding = choose_content_encoding(request.accept_encodings) if len(body) >= COMPRESSION_THRESHOLD else None
+    if encoding:
+        body = compress(body, encoding)
+        response.headers['Content-Encoding'] = encoding
+
+    response.set_data(body)
+    return response
@@ -0,0 +1,138 @@
+"""
+SQL storage backend built on the SQLAlchemy models in models.py.
+
+Every child row carries the owning user_id and its position in the user's
+list; (user_id, position) is a unique index, so a user's portfolio is read
+with one index range scan per table. Saves are bulk upserts keyed on that
+index, followed by a delete of positions past the new end, all in one
+transaction. Connections come from a pool shared by the process.
+
+Works with SQLite (WAL mode) and PostgreSQL; other dialects fall back to
+delete-and-insert.
+"""
+from sqlalchemy import create_engine, delete, event, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from models import Base, User, Income, Asset, Debt, RetirementAccount, Insurance, FilingStatus, USState
+from repository import PortfolioRepository
+
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE = 1800 # seconds; stay under server-side idle timeouts
+
+ITEM_MODELS = {'incomes': Income, 'assets': Asset, 'debts': Debt}
+# Columns managed by the repository rather than copied from model objects
+_KEY_COLUMNS = {'id', 'user_id', 'position'}
+
+def create_db_engine(url):
+    """Creates a pooled engine; SQLite gets WAL mode and cross-thread connections."""
+    if url.startswith('sqlite'):
+        if url in ['sqlite://', 'sqlite:///:memory:']:
+            # An in-memory database only exists on its one connection
+            engine = create_engine(url, connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        else:
+            engine = create_engine(url, connect_args={'check_same_thread': False}, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+        return engine
+    return create_engine(url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE, pool_pre_ping=True)
+
+def _values(obj, exclude=_KEY_COLUMNS):
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns if column.key not in exclude}
+
+def _upsert(session, model, rows, conflict_columns):
+    """Inserts rows, updating existing ones that match on `conflict_columns`, in one executemany."""
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        for row in rows:
+            session.execute(delete(model).where(*[getattr(model, c) == row[c] for c in conflict_columns]))
+        session.execute(model.__table__.insert(), rows)
+        return
+    statement = insert(model)
+    statement = statement.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={key: statement.excluded[key] for key in rows[0] if key not in conflict_columns}
+    )
+    session.execute(statement, rows)
+
+class SQLRepository(PortfolioRepository):
+    def __init__(self, url='sqlite:///finance.db', create_tables=True):
+        self.engine = create_db_engine(url)
+        if create_tables:
+            Base.metadata.create_all(self.engine)
+        # Objects stay usable after the session closes; they are returned detached
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def get_user_data(self, user_id="default_user"):
+        with self.Session() as session:
+            user = session.get(User, user_id)
+            if user is None:
+                return User(filing_status=FilingStatus.SINGLE, state=USState.CA), [], [], [], [], []
+            def rows(model):
+                return list(session.scalars(select(model).where(model.user_id == user_id).order_by(model.position)))
+            return user, rows(Income), rows(Asset), rows(Debt), rows(RetirementAccount), rows(Insurance)
+
+    def get_user_profile(self, user_id="default_user"):
+        with self.Session() as session:
+            user = session.get(User, user_id)
+            if user is None:
+                return User(filing_status=FilingStatus.SINGLE, state=USState.CA), [], []
+            def rows(model):
+                return list(session.scalars(select(model).where(model.user_id == user_id).order_by(model.position)))
+            return user, rows(RetirementAccount), rows(Insurance)
+
+    def get_users_data(self, user_ids):
+        """One query per table for all users, however many there are."""
+        with self.Session() as session:
+            users = {user.id: user for user in session.scalars(select(User).where(User.id.in_(user_ids)))}
+            def rows(model):
+                grouped = {user_id: [] for user_id in user_ids}
+                for row in session.scalars(select(model).where(model.user_id.in_(user_ids)).order_by(model.user_id, model.position)):
+                    grouped[row.user_id].append(row)
+                return grouped
+            incomes, assets, debts, retirement_accounts, insurances = rows(Income), rows(Asset), rows(Debt), rows(RetirementAccount), rows(Insurance)
+        return {
+            user_id: (
+                users.get(user_id) or User(filing_status=FilingStatus.SINGLE, state=USState.CA),
+                incomes[user_id], assets[user_id], debts[user_id], retirement_accounts[user_id], insurances[user_id]
+            )
+            for user_id in user_ids
+        }
+
+    def save_user_data(self, user, incomes, assets, debts, retirement_accounts, insurances, user_id="default_user"):
+        with self.Session.begin() as session:
+            _upsert(session, User, [{'id': user_id, 'filing_status': user.filing_status, 'state': user.state}], ['id'])
+            for model, items in [(Income, incomes), (Asset, assets), (Debt, debts), (Insurance, insurances)]:
+                _upsert(session, model, [dict(_values(item), user_id=user_id, position=position) for position, item in enumerate(items)], ['user_id', 'position'])
+                session.execute(delete(model).where(model.user_id == user_id, model.position >= len(items)))
+
+            account_rows = [dict(_values(ra, exclude={'user_id', 'position'}), user_id=user_id, position=position) for position, ra in enumerate(retirement_accounts)]
+            _upsert(session, RetirementAccount, account_rows, ['user_id', 'id'])
+            session.execute(delete(RetirementAccount).where(RetirementAccount.user_id == user_id, RetirementAccount.id.not_in([row['id'] for row in account_rows])))
+
+    def save_user_profile(self, user, user_id="default_user"):
+        with self.Session.begin() as session:
+            _upsert(session, User, [{'id': user_id, 'filing_status': user.filing_status, 'state': user.state}], ['id'])
+
+    def list_user_items(self, collection, user_id="default_user", limit=50, cursor=None):
+        model = ITEM_MODELS[collection]
+        query = select(model).where(model.user_id == user_id)
+        if cursor:
+            query = query.where(model.position > int(cursor))
+        # Read one extra row to learn whether another page exists
+        with self.Session() as session:
+            items = list(session.scalars(query.order_by(model.position).limit(limit + 1)))
+        # Same cursor format as the Firestore backend's document ids
+        next_cursor = f"{items[limit - 1].position:06d}" if len(items) > limit else None
+        return items[:limit], next_cursor
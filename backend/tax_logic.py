@@ -186,14 +186,25 @@ for state_code in STATE_TAX_BRACKETS_2026:
 STATE_TAX_BRACKETS_2026['CA']['married_filing_separately'] = STATE_TAX_BRACKETS_2026['CA']['single']
 STATE_TAX_BRACKETS_2026['CA']['qualifying_widow'] = STATE_TAX_BRACKETS_2026['CA']['married_filing_jointly']
 
+def get_federal_schedule(filing_status='single'):
+    """Returns the federal deduction/brackets entry for a filing status."""
+    if filing_status not in FEDERAL_TAX_BRACKETS_2026:
+        return FEDERAL_TAX_BRACKETS_2026.get('single')
+    return FEDERAL_TAX_BRACKETS_2026[filing_status]
+
+def get_state_schedule(state='CA', filing_status='single'):
+    """Returns the state deduction/brackets entry, or None for an unknown state."""
+    if state not in STATE_TAX_BRACKETS_2026:
+        return None
+    if filing_status not in STATE_TAX_BRACKETS_2026[state]:
+        return STATE_TAX_BRACKETS_2026[state].get('single')
+    return STATE_TAX_BRACKETS_2026[state][filing_status]
+
 def calculate_federal_tax(income, filing_status='single'):
     """
     Calculates the federal tax for a given income and filing status.
     """
-    if filing_status not in FEDERAL_TAX_BRACKETS_2026:
-        status_brackets = FEDERAL_TAX_BRACKETS_2026.get('single')
-    else:
-        status_brackets = FEDERAL_TAX_BRACKETS_2026[filing_status]
+    status_brackets = get_federal_schedule(filing_status)
 
     taxable_income = max(0, income - status_brackets['deduction'])
     
@@ -220,14 +231,10 @@ def calculate_state_tax(income, state='CA', filing_status='single'):
     """
     Calculates the state tax for a given income, state, and filing status.
     """
-    if state not in STATE_TAX_BRACKETS_2026:
+    state_brackets = get_state_schedule(state, filing_status)
+    if state_brackets is None:
         # Fallback to 0 if not found (should not happen with full list)
         return 0
-    
-    if filing_status not in STATE_TAX_BRACKETS_2026[state]:
-        state_brackets = STATE_TAX_BRACKETS_2026[state].get('single')
-    else:
-        state_brackets = STATE_TAX_BRACKETS_2026[state][filing_status]
 
     taxable_income = max(0, income - state_brackets['deduction'])
     
@@ -258,12 +265,21 @@ def calculate_fica_tax(income, filing_status='single'):
     """
     Calculates FICA taxes (Social Security and Medicare) for 2026.
     """
+    return calculate_household_fica_tax([income], filing_status)
+
+def calculate_household_fica_tax(wages, filing_status='single'):
+    """
+    Calculates 2026 FICA taxes for a household given each earner's wages.
+    The Social Security wage cap applies per earner; the Additional Medicare
+    Tax threshold applies to the combined wages of a joint return.
+    """
     ss_cap = 176100
     ss_rate = 0.062
-    ss_tax = min(income, ss_cap) * ss_rate
+    ss_tax = sum(min(income, ss_cap) for income in wages) * ss_rate
 
+    total_wages = sum(wages)
     medicare_rate = 0.0145
-    medicare_tax = income * medicare_rate
+    medicare_tax = total_wages * medicare_rate
 
     add_medicare_rate = 0.009
     if filing_status == 'married_filing_jointly':
@@ -273,6 +289,171 @@ def calculate_fica_tax(income, filing_status='single'):
     else:
         threshold = 200000
 
-    add_medicare_tax = max(0, income - threshold) * add_medicare_rate
+    add_medicare_tax = max(0, total_wages - threshold) * add_medicare_rate
 
     return ss_tax + medicare_tax + add_medicare_tax
+
+# Annual employee contribution limits for 2026 (catch-up contributions not modeled).
+# 401k/403b deferrals count as Traditional; the IRA limit is shared by Traditional and Roth IRAs.
+RETIREMENT_CONTRIBUTION_LIMITS_2026 = {
+    'employer_plan': 24500,
+    'ira': 7500
+}
+
+def tax_breakpoints(schedule):
+    """
+    Returns the gross incomes at which the marginal rate of a deduction/brackets
+    entry changes. The tax is linear between consecutive breakpoints.
+    """
+    deduction = schedule['deduction']
+    points = [deduction]
+    for bracket in schedule['brackets']:
+        if bracket['up_to'] != float('inf'):
+            points.append(deduction + bracket['up_to'])
+    if 'mental_health_tax_threshold' in schedule:
+        points.append(deduction + schedule['mental_health_tax_threshold'])
+    return points
+
+def optimize_retirement_contributions(gross_income, contribution, filing_status='single', state='CA', other_deductions=0, retirement_income=0, retirement_state=None, limits=RETIREMENT_CONTRIBUTION_LIMITS_2026):
+    """
+    Splits an annual retirement contribution between Traditional and Roth to
+    minimize combined tax.
+
+    Traditional dollars are deducted from this year's taxable income and taxed
+    as ordinary income on withdrawal, on top of `retirement_income`; Roth
+    dollars are taxed now and withdrawn tax-free. Federal and state tax are both
+    piecewise-linear in the Traditional amount, so the minimum lies at one of
+    their breakpoints or at the ends of the feasible range, and only those
+    candidates are evaluated. FICA is charged on gross wages either way.
+    """
+    retirement_state = retirement_state or state
+    contribution = max(0, min(contribution, gross_income, limits['employer_plan'] + limits['ira']))
+    base_taxable = max(0, gross_income - other_deductions)
+
+    # Roth is only available through the IRA, so at least contribution - ira_limit must go Traditional
+    lowest = max(0, contribution - limits['ira'])
+    highest = contribution
+
+    candidates = {lowest, highest}
+    current_schedules = [get_federal_schedule(filing_status), get_state_schedule(state, filing_status)]
+    for schedule in current_schedules:
+        if schedule is None:
+            continue
+        for point in tax_breakpoints(schedule) + [0]:
+            candidates.add(base_taxable - point)
+    retirement_schedules = [get_federal_schedule(filing_status), get_state_schedule(retirement_state, filing_status)]
+    for schedule in retirement_schedules:
+        if schedule is None:
+            continue
+        for point in tax_breakpoints(schedule):
+            candidates.add(point - retirement_income)
+
+    def evaluate(traditional):
+        taxable_income = max(0, base_taxable - traditional)
+        withdrawal_income = retirement_income + traditional
+        federal_tax = calculate_federal_tax(taxable_income, filing_status)
+        state_tax = calculate_state_tax(taxable_income, state, filing_status)
+        # Only the part of retirement-year tax caused by the withdrawals counts against Traditional
+        retirement_federal_tax = calculate_federal_tax(withdrawal_income, filing_status) - calculate_federal_tax(retirement_income, filing_status)
+        retirement_state_tax = calculate_state_tax(withdrawal_income, retirement_state, filing_status) - calculate_state_tax(retirement_income, retirement_state, filing_status)
+        return {
+            'traditional': traditional,
+            'roth': contribution - traditional,
+            'federal_tax': federal_tax,
+            'state_tax': state_tax,
+            'retirement_federal_tax': retirement_federal_tax,
+            'retirement_state_tax': retirement_state_tax
+        }
+
+    fica_tax = calculate_fica_tax(gross_income, filing_status)
+    best = None
+    for traditional in candidates:
+        if traditional < lowest or traditional > highest:
+            continue
+        result = evaluate(traditional)
+        result['total_tax'] = result['federal_tax'] + result['state_tax'] + fica_tax + result['retirement_federal_tax'] + result['retirement_state_tax']
+        # Ties go to Roth, whose growth is never taxed
+        if best is None or (result['total_tax'], result['traditional']) < (best['total_tax'], best['traditional']):
+            best = result
+
+    best['fica_tax'] = fica_tax
+    best['contribution'] = contribution
+    best['employer_plan'] = min(best['traditional'], limits['employer_plan'])
+    best['traditional_ira'] = best['traditional'] - best['employer_plan']
+    best['roth_ira'] = best['roth']
+    return best
+
+# Federal long-term capital gains rates for 2026, by taxable income (ordinary income plus gains).
+LONG_TERM_CAPITAL_GAINS_BRACKETS_2026 = {
+    'single': [{'rate': 0.0, 'up_to': 49450}, {'rate': 0.15, 'up_to': 545500}, {'rate': 0.20, 'up_to': float('inf')}],
+    'married_filing_jointly': [{'rate': 0.0, 'up_to': 98900}, {'rate': 0.15, 'up_to': 613700}, {'rate': 0.20, 'up_to': float('inf')}],
+    'head_of_household': [{'rate': 0.0, 'up_to': 66200}, {'rate': 0.15, 'up_to': 579600}, {'rate': 0.20, 'up_to': float('inf')}],
+    'married_filing_separately': [{'rate': 0.0, 'up_to': 49450}, {'rate': 0.15, 'up_to': 306850}, {'rate': 0.20, 'up_to': float('inf')}]
+}
+LONG_TERM_CAPITAL_GAINS_BRACKETS_2026['qualifying_widow'] = LONG_TERM_CAPITAL_GAINS_BRACKETS_2026['married_filing_jointly']
+
+NET_INVESTMENT_INCOME_TAX_RATE = 0.038
+NET_INVESTMENT_INCOME_TAX_THRESHOLDS = {'married_filing_jointly': 250000, 'qualifying_widow': 250000, 'married_filing_separately': 125000}
+CAPITAL_LOSS_ORDINARY_LIMIT = 3000
+
+def net_capital_gains(short_term_gain, long_term_gain):
+    """Nets short- and long-term results against each other, as on Schedule D."""
+    if short_term_gain < 0 < long_term_gain:
+        offset = min(-short_term_gain, long_term_gain)
+        return short_term_gain + offset, long_term_gain - offset
+    if long_term_gain < 0 < short_term_gain:
+        offset = min(-long_term_gain, short_term_gain)
+        return short_term_gain - offset, long_term_gain + offset
+    return short_term_gain, long_term_gain
+
+def calculate_capital_gains_tax(ordinary_income, short_term_gain, long_term_gain, filing_status='single', state='CA'):
+    """
+    Calculates the additional tax caused by realizing capital gains on top of
+    `ordinary_income` (gross, before the standard deduction).
+
+    Net short-term gains are taxed federally as ordinary income; net long-term
+    gains are stacked on top of taxable ordinary income at 0/15/20%, plus the
+    3.8% net investment income tax above its threshold. States tax all gains
+    as ordinary income. A net loss offsets at most $3,000 ($1,500 filing
+    separately) of ordinary income.
+    """
+    short_term, long_term = net_capital_gains(short_term_gain, long_term_gain)
+    loss_limit = CAPITAL_LOSS_ORDINARY_LIMIT / 2 if filing_status == 'married_filing_separately' else CAPITAL_LOSS_ORDINARY_LIMIT
+    deductible_loss = min(loss_limit, -(min(short_term, 0) + min(long_term, 0)))
+    short_term, long_term = max(0, short_term), max(0, long_term)
+
+    ordinary_with_gains = ordinary_income + short_term - deductible_loss
+    base_federal_tax = calculate_federal_tax(ordinary_income, filing_status)
+    federal_ordinary_tax = calculate_federal_tax(ordinary_with_gains, filing_status) - base_federal_tax
+
+    deduction = get_federal_schedule(filing_status)['deduction']
+    taxable_ordinary = max(0, ordinary_with_gains - deduction)
+    taxable_total = max(0, ordinary_with_gains + long_term - deduction)
+    federal_long_term_tax = 0
+    previous_bracket_limit = 0
+    for bracket in LONG_TERM_CAPITAL_GAINS_BRACKETS_2026.get(filing_status, LONG_TERM_CAPITAL_GAINS_BRACKETS_2026['single']):
+        # Only the slice of this bracket occupied by gains (above the ordinary income) is taxed here
+        low = max(previous_bracket_limit, taxable_ordinary)
+        high = min(bracket['up_to'], taxable_total)
+        if high > low:
+            federal_long_term_tax += (high - low) * bracket['rate']
+        previous_bracket_limit = bracket['up_to']
+
+    niit_threshold = NET_INVESTMENT_INCOME_TAX_THRESHOLDS.get(filing_status, 200000)
+    investment_income = short_term + long_term
+    niit = NET_INVESTMENT_INCOME_TAX_RATE * min(investment_income, max(0, ordinary_income + investment_income - niit_threshold))
+
+    state_tax = calculate_state_tax(ordinary_with_gains + long_term, state, filing_status) - calculate_state_tax(ordinary_income, state, filing_status)
+
+    return {
+        'short_term_gain': short_term_gain,
+        'long_term_gain': long_term_gain,
+        'net_short_term_gain': short_term,
+        'net_long_term_gain': long_term,
+        'deductible_loss': deductible_loss,
+        'federal_ordinary_tax': federal_ordinary_tax,
+        'federal_long_term_tax': federal_long_term_tax,
+        'net_investment_income_tax': niit,
+        'state_tax': state_tax,
+        'total_tax': federal_ordinary_tax + federal_long_term_tax + niit + state_tax
+    }
@@ -0,0 +1,254 @@
+"""
+Tax-lot tracking and sale simulation.
+
+Lots are indexed per ticker in acquisition-date order with running totals of
+shares and cost, so the cost of the first or last N shares is a binary search.
+Because lots held more than a year form a prefix of that order, FIFO and LIFO
+sales split into short- and long-term gains in O(log n) without visiting the
+lots sold. HIFO walks lots in unit-cost order and specific-ID looks lots up by
+id, both touching only the lots actually sold.
+"""
+from bisect import bisect_left
+from datetime import date
+from models import TaxLot
+
+FIFO = 'FIFO'
+LIFO = 'LIFO'
+HIFO = 'HIFO'
+SPECIFIC_ID = 'SPECIFIC_ID'
+SALE_METHODS = [FIFO, LIFO, HIFO, SPECIFIC_ID]
+
+# Shares left over from float arithmetic below this are treated as zero
+SHARE_EPSILON = 1e-9
+
+class TaxLotError(ValueError):
+    """Raised for sales the lots cannot cover (too many shares, unknown lot ids, bad method)."""
+
+def long_term_cutoff(sale_date: date):
+    """Lots acquired before this date have been held more than one year on `sale_date`."""
+    if sale_date.month == 2 and sale_date.day == 29:
+        # A year before Feb 29 has no Feb 29; anything bought on Feb 28 has been held over a year
+        return date(sale_date.year - 1, 3, 1)
+    return sale_date.replace(year=sale_date.year - 1)
+
+def _sale_leg():
+    return {'shares': 0.0, 'proceeds': 0.0, 'cost_basis': 0.0, 'gain': 0.0}
+
+class TickerLots:
+    """The lots of one ticker, ordered by acquisition date."""
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.lots = []
+        self._keys = []
+        self._index = None
+
+    def add(self, lot: TaxLot):
+        key = (lot.acquired, lot.id)
+        position = bisect_left(self._keys, key)
+        self._keys.insert(position, key)
+        self.lots.insert(position, lot)
+        self._index = None
+
+    def _build(self):
+        """Builds the prefix sums and lookups; rebuilt lazily after lots change."""
+        dates = []
+        unit_costs = []
+        cum_shares = [0.0]
+        cum_cost = [0.0]
+        positions = {}
+        for position, lot in enumerate(self.lots):
+            dates.append(lot.acquired)
+            unit_costs.append(lot.cost_basis / lot.shares)
+            cum_shares.append(cum_shares[-1] + lot.shares)
+            cum_cost.append(cum_cost[-1] + lot.cost_basis)
+            positions[lot.id] = position
+        # Highest unit cost first; among equal costs the older lot, which is likelier long-term
+        by_unit_cost = sorted(range(len(self.lots)), key=lambda i: (-unit_costs[i], dates[i]))
+        self._index = {
+            'dates': dates,
+            'unit_costs': unit_costs,
+            'cum_shares': cum_shares,
+            'cum_cost': cum_cost,
+            'positions': positions,
+            'by_unit_cost': by_unit_cost,
+            # Plain columns in unit-cost order, so HIFO sales avoid ORM attribute access per lot
+            'hifo_dates': [dates[i] for i in by_unit_cost],
+            'hifo_shares': [cum_shares[i + 1] - cum_shares[i] for i in by_unit_cost],
+            'hifo_unit_costs': [unit_costs[i] for i in by_unit_cost]
+        }
+        return self._index
+
+    @property
+    def index(self):
+        return self._index or self._build()
+
+    @property
+    def total_shares(self):
+        return self.index['cum_shares'][-1]
+
+    def cost_of_first(self, shares):
+        """Cost basis of the `shares` earliest-acquired shares."""
+        index = self.index
+        cum_shares, cum_cost = index['cum_shares'], index['cum_cost']
+        i = bisect_left(cum_shares, shares)
+        if i >= len(cum_shares):
+            return cum_cost[-1]
+        if cum_shares[i] == shares:
+            return cum_cost[i]
+        # Lot i-1 is only partly included
+        return cum_cost[i - 1] + (shares - cum_shares[i - 1]) * index['unit_costs'][i - 1]
+
+    def cost_of_last(self, shares):
+        """Cost basis of the `shares` most recently acquired shares."""
+        return self.index['cum_cost'][-1] - self.cost_of_first(self.total_shares - shares)
+
+    def _hifo_legs(self, shares, sale_date, short_term, long_term):
+        """Fills the legs of a HIFO sale by walking lots in unit-cost order until `shares` are covered."""
+        index = self.index
+        cutoff = long_term_cutoff(sale_date)
+        remaining = shares
+        for acquired, lot_shares, unit_cost in zip(index['hifo_dates'], index['hifo_shares'], index['hifo_unit_costs']):
+            if remaining <= SHARE_EPSILON:
+                break
+            taken = lot_shares if lot_shares < remaining else remaining
+            leg = long_term if acquired < cutoff else short_term
+            leg['shares'] += taken
+            leg['cost_basis'] += taken * unit_cost
+            remaining -= taken
+
+    def long_term_shares(self, sale_date):
+        return self.index['cum_shares'][bisect_left(self.index['dates'], long_term_cutoff(sale_date))]
+
+    def simulate_sale(self, shares, price, sale_date, method=FIFO, selections=None, include_lots=False):
+        """
+        Returns the proceeds, cost basis and gain of selling `shares` at `price`
+        on `sale_date`, split into short- and long-term legs. Nothing is modified.
+        `selections` lists (lot_id, shares) pairs for SPECIFIC_ID sales.
+        """
+        if method not in SALE_METHODS:
+            raise TaxLotError(f"Invalid sale method: {method}")
+        if method == SPECIFIC_ID:
+            if not selections:
+                raise TaxLotError("Specific-ID sales must select lots.")
+            shares = sum(selected for _, selected in selections)
+        if shares <= 0:
+            raise TaxLotError("Shares to sell must be positive.")
+        if shares > self.total_shares + SHARE_EPSILON:
+            raise TaxLotError(f"Cannot sell {shares} shares of {self.ticker}; only {self.total_shares} held.")
+        shares = min(shares, self.total_shares)
+
+        short_term, long_term = _sale_leg(), _sale_leg()
+        lots = []
+        if method in [FIFO, LIFO]:
+            long_available = self.long_term_shares(sale_date)
+            if method == FIFO:
+                long_term['shares'] = min(shares, long_available)
+                long_term['cost_basis'] = self.cost_of_first(long_term['shares'])
+                short_term['shares'] = shares - long_term['shares']
+                short_term['cost_basis'] = self.cost_of_first(shares) - long_term['cost_basis']
+            else:
+                short_term['shares'] = min(shares, self.total_shares - long_available)
+                short_term['cost_basis'] = self.cost_of_last(short_term['shares'])
+                long_term['shares'] = shares - short_term['shares']
+                long_term['cost_basis'] = self.cost_of_last(shares) - short_term['cost_basis']
+            if include_lots:
+                order = range(len(self.lots)) if method == FIFO else range(len(self.lots) - 1, -1, -1)
+                lots = self._walk(order, shares, price, sale_date)
+        elif method == HIFO:
+            self._hifo_legs(shares, sale_date, short_term, long_term)
+            if include_lots:
+                lots = self._walk(self.index['by_unit_cost'], shares, price, sale_date)
+        else:
+            lots = self._select(selections, price, sale_date)
+            for lot in lots:
+                leg = long_term if lot['term'] == 'long' else short_term
+                leg['shares'] += lot['shares']
+                leg['cost_basis'] += lot['cost_basis']
+            if not include_lots:
+                lots = []
+
+        for leg in (short_term, long_term):
+            leg['proceeds'] = leg['shares'] * price
+            leg['gain'] = leg['proceeds'] - leg['cost_basis']
+        result = {
+            'ticker': self.ticker,
+            'method': method,
+            'shares': shares,
+            'price': price,
+            'sale_date': sale_date.isoformat(),
+            'proceeds': short_term['proceeds'] + long_term['proceeds'],
+            'cost_basis': short_term['cost_basis'] + long_term['cost_basis'],
+            'gain': short_term['gain'] + long_term['gain'],
+            'short_term': short_term,
+            'long_term': long_term
+        }
+        if include_lots:
+            result['lots'] = lots
+        return result
+
+    def _lot_sale(self, lot, shares, price, cutoff):
+        cost_basis = lot.cost_basis * shares / lot.shares
+        return {
+            'lot_id': lot.id,
+            'acquired': lot.acquired.isoformat(),
+            'shares': shares,
+            'cost_basis': cost_basis,
+            'proceeds': shares * price,
+            'gain': shares * price - cost_basis,
+            'term': 'long' if lot.acquired < cutoff else 'short'
+        }
+
+    def _walk(self, order, shares, price, sale_date):
+        """Sells whole lots in `order` until `shares` are covered; only the lots sold are visited."""
+        cutoff = long_term_cutoff(sale_date)
+        remaining = shares
+        sold = []
+        for position in order:
+            if remaining <= SHARE_EPSILON:
+                break
+            lot = self.lots[position]
+            taken = min(remaining, lot.shares)
+            sold.append(self._lot_sale(lot, taken, price, cutoff))
+            remaining -= taken
+        return sold
+
+    def _select(self, selections, price, sale_date):
+        cutoff = long_term_cutoff(sale_date)
+        positions = self.index['positions']
+        # Several selections of one lot draw on the same shares, so check their total
+        totals = {}
+        for lot_id, shares in selections:
+            if shares <= 0:
+                raise TaxLotError(f"Cannot sell {shares} shares of lot {lot_id}.")
+            totals[lot_id] = totals.get(lot_id, 0.0) + shares
+        sold = []
+        for lot_id, shares in totals.items():
+            if lot_id not in positions:
+                raise TaxLotError(f"Unknown lot for {self.ticker}: {lot_id}")
+            lot = self.lots[positions[lot_id]]
+            if shares > lot.shares + SHARE_EPSILON:
+                raise TaxLotError(f"Lot {lot_id} holds {lot.shares} shares; cannot sell {shares}.")
+            sold.append(self._lot_sale(lot, min(shares, lot.shares), price, cutoff))
+        return sold
+
+class LotIndex:
+    """Lots grouped by ticker, each group kept in acquisition-date order."""
+    def __init__(self, lots: list[TaxLot] = []):
+        self.tickers = {}
+        for lot in lots:
+            self.add(lot)
+
+    def add(self, lot: TaxLot):
+        ticker_lots = self.tickers.get(lot.ticker)
+        if ticker_lots is None:
+            ticker_lots = self.tickers[lot.ticker] = TickerLots(lot.ticker)
+        ticker_lots.add(lot)
+
+    def get(self, ticker):
+        return self.tickers.get(ticker)
+
+    def simulate_sale(self, ticker, shares, price, sale_date=None, method=FIFO, selections=None, include_lots=False):
+        ticker_lots = self.tickers.get(ticker)
+        if ticker_lots is None:
+            raise TaxLotError(f"No lots held for {ticker}.")
+        return ticker_lots.simulate_sale(shares, price, sale_date or date.today(), method, selections, include_lots)
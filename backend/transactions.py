@@ -0,0 +1,424 @@
+"""
+Streaming import of bank transaction exports (CSV or OFX).
+
+The file is consumed as a stream of row chunks flowing through generator
+stages: parse -> normalize/categorize -> deduplicate -> aggregate. Only a
+few months of state are open at a time, and only monthly aggregates and the
+detected recurring charges are written back, so memory stays bounded no matter
+how many years the export covers.
+"""
+import csv
+import hashlib
+import re
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from firestore_db import get_transaction_month, save_transaction_month, get_recurring_charges, save_recurring_charges
+
+CHUNK_SIZE = 10000
+# Months kept in memory before the least recently touched one is written back.
+# Exports are chronological, so in practice only the current month is active.
+OPEN_MONTHS_LIMIT = 3
+
+CSV_COLUMN_ALIASES = {
+    'date': ['date', 'transaction date', 'posted date', 'posting date', 'trans. date'],
+    'description': ['description', 'payee', 'name', 'merchant', 'details', 'memo'],
+    'amount': ['amount', 'transaction amount'],
+    'debit': ['debit', 'withdrawal', 'withdrawals'],
+    'credit': ['credit', 'deposit', 'deposits']
+}
+
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%Y%m%d', '%d-%b-%Y']
+
+# Keywords are matched against the cleaned description (upper case, no digits or punctuation)
+MERCHANT_CATEGORIES = {
+    'Groceries': ['WHOLE FOODS', 'TRADER JOE', 'SAFEWAY', 'KROGER', 'COSTCO', 'ALDI', 'PUBLIX', 'GROCERY'],
+    'Dining': ['STARBUCKS', 'MCDONALD', 'CHIPOTLE', 'DOORDASH', 'UBER EATS', 'GRUBHUB', 'RESTAURANT', 'CAFE'],
+    'Transportation': ['UBER', 'LYFT', 'SHELL', 'CHEVRON', 'EXXON', 'PARKING', 'TRANSIT'],
+    'Subscriptions': ['NETFLIX', 'SPOTIFY', 'HULU', 'DISNEY PLUS', 'APPLE COM BILL', 'AMAZON PRIME', 'YOUTUBE', 'ADOBE', 'GYM'],
+    'Shopping': ['AMAZON', 'TARGET', 'WALMART', 'BEST BUY', 'EBAY'],
+    'Utilities': ['COMCAST', 'VERIZON', 'AT&T', 'T MOBILE', 'PG&E', 'ELECTRIC', 'WATER'],
+    'Housing': ['RENT', 'MORTGAGE'],
+    'Income': ['PAYROLL', 'DIRECT DEP', 'SALARY', 'INTEREST'],
+    'Transfers': ['TRANSFER', 'ZELLE', 'VENMO']
+}
+
+_KEYWORD_CATEGORIES = {keyword: category for category, keywords in MERCHANT_CATEGORIES.items() for keyword in keywords}
+# Longest keywords first so 'UBER EATS' wins over 'UBER'
+_CATEGORY_RE = re.compile('|'.join(
+    r'\b' + re.escape(keyword) + r'\b' for keyword in sorted(_KEYWORD_CATEGORIES, key=len, reverse=True)
+))
+_PREFIX_RE = re.compile(r'^(?:POS |ACH |DEBIT |CREDIT |PURCHASE |CHECKCARD |RECURRING |SQ \*|TST\* ?|PP\*|PAYPAL \*)+')
+_NOISE_RE = re.compile(r'[#*]?\d[\d\-/.:]*|[^A-Z& ]')
+_OFX_TAG_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+# Parsers yield plain (date, amount, description, fitid) tuples; normalize() turns them into these
+NormalizedTransaction = namedtuple('NormalizedTransaction', ['date', 'amount', 'description', 'merchant', 'category', 'fitid'])
+
+class TransactionImportError(ValueError):
+    """Raised when an export cannot be read at all (e.g. unknown CSV columns)."""
+
+@lru_cache(maxsize=8192)
+def parse_date(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_amount(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    value = value.strip().replace('$', '').replace(',', '')
+    if not value:
+        return 0.0
+    if value.startswith('(') and value.endswith(')'):
+        return -float(value[1:-1])
+    return float(value)
+
+@lru_cache(maxsize=65536)
+def describe(description):
+    """
+    Returns (merchant, category) for a raw description. Prefixes, store numbers
+    and punctuation are stripped before matching MERCHANT_CATEGORIES.
+    """
+    cleaned = ' '.join(_NOISE_RE.sub(' ', _PREFIX_RE.sub('', description.upper())).split())
+    merchant = ' '.join(cleaned.split()[:3]) or description.upper()
+    match = _CATEGORY_RE.search(cleaned)
+    return merchant, _KEYWORD_CATEGORIES[match.group(0)] if match else 'Uncategorized'
+
+def _find_column(header, field):
+    for alias in CSV_COLUMN_ALIASES[field]:
+        if alias in header:
+            return header.index(alias)
+    return None
+
+def parse_csv(stream, stats, chunk_size=CHUNK_SIZE):
+    """Yields chunks of (date, amount, description, fitid) from a CSV text stream."""
+    reader = csv.reader(stream)
+    header = [column.strip().lower() for column in next(reader, [])]
+    date_col = _find_column(header, 'date')
+    desc_col = _find_column(header, 'description')
+    amount_col = _find_column(header, 'amount')
+    debit_col = _find_column(header, 'debit')
+    credit_col = _find_column(header, 'credit')
+    if date_col is None or desc_col is None or (amount_col is None and debit_col is None and credit_col is None):
+        raise TransactionImportError("CSV must have date, description and amount (or debit/credit) columns.")
+
+    chunk = []
+    for row in reader:
+        stats['rows'] += 1
+        try:
+            txn_date = parse_date(row[date_col])
+            if amount_col is not None:
+                amount = parse_amount(row[amount_col])
+            else:
+                credit = parse_amount(row[credit_col]) if credit_col is not None else 0.0
+                debit = parse_amount(row[debit_col]) if debit_col is not None else 0.0
+                amount = credit - abs(debit)
+            description = row[desc_col].strip()
+        except (IndexError, ValueError):
+            txn_date = None
+        if txn_date is None:
+            stats['skipped'] += 1
+            continue
+        chunk.append((txn_date, amount, description, None))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _ofx_tokens(stream, read_size=1 << 16):
+    """Yields (is_closing, tag, value) from an OFX stream, reading it in blocks."""
+    buffer = ''
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        buffer += data
+        # A token's value runs up to the next '<', so only tokens before the last '<' are complete
+        cut = buffer.rfind('<')
+        if cut <= 0:
+            continue
+        for closing, tag, value in _OFX_TAG_RE.findall(buffer, 0, cut):
+            yield closing, tag.upper(), value.strip()
+        buffer = buffer[cut:]
+    for closing, tag, value in _OFX_TAG_RE.findall(buffer):
+        yield closing, tag.upper(), value.strip()
+
+def parse_ofx(stream, stats, chunk_size=CHUNK_SIZE):
+    """Yields chunks of (date, amount, description, fitid) from an OFX (SGML or XML) text stream."""
+    chunk = []
+    account = ''
+    current = None
+    for closing, tag, value in _ofx_tokens(stream):
+        if tag == 'STMTTRN':
+            if not closing:
+                current = {}
+                continue
+            if current is None:
+                continue
+            stats['rows'] += 1
+            try:
+                txn_date = parse_date(current.get('DTPOSTED', '')[:8])
+                amount = parse_amount(current.get('TRNAMT', ''))
+            except ValueError:
+                txn_date = None
+            if txn_date is None:
+                stats['skipped'] += 1
+            else:
+                description = current.get('NAME') or current.get('MEMO') or ''
+                fitid = current.get('FITID')
+                chunk.append((txn_date, amount, description, f"{account}:{fitid}" if fitid else None))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            current = None
+        elif tag == 'ACCTID' and not closing:
+            account = value
+        elif current is not None and not closing:
+            current[tag] = value
+    if chunk:
+        yield chunk
+
+def normalize(chunks):
+    """Turns parsed rows into NormalizedTransaction with merchant and category filled in."""
+    for chunk in chunks:
+        normalized = []
+        for txn_date, amount, description, fitid in chunk:
+            merchant, category = describe(description)
+            normalized.append(NormalizedTransaction(txn_date, amount, description, merchant, category, fitid))
+        yield normalized
+
+def _fingerprint(basis):
+    return int.from_bytes(hashlib.blake2b(basis.encode(), digest_size=8).digest(), 'big')
+
+class MonthlyAggregator:
+    """
+    Deduplicates transactions and accumulates per-month totals.
+    Each month's stored aggregate (including the fingerprints of the transactions
+    already imported) is loaded the first time the month is seen and written back
+    when it is evicted or on flush(), so re-importing overlapping exports is safe.
+    Without a user_id, evicted months are kept in memory instead of written.
+    """
+    def __init__(self, user_id=None, open_months_limit=OPEN_MONTHS_LIMIT):
+        self.user_id = user_id
+        self.open_months_limit = open_months_limit
+        self.open_months = OrderedDict()
+        self.touched_months = set()
+        # Months evicted from a guest import, which has nowhere to write them
+        self.unsaved_months = {}
+        # Occurrences of identical rows within this import, so two real same-day
+        # charges for the same amount are not mistaken for duplicates. Kept for
+        # the whole import: a month evicted and loaded again must count on from
+        # where it stopped.
+        self.ordinals = {}
+
+    def _load(self, key):
+        if key in self.unsaved_months:
+            return self.unsaved_months.pop(key)
+        stored = get_transaction_month(key, user_id=self.user_id) if self.user_id else None
+        stored = stored or {}
+        return {
+            'month': key,
+            'income': stored.get('income', 0.0),
+            'spending': stored.get('spending', 0.0),
+            'count': stored.get('count', 0),
+            'by_category': dict(stored.get('by_category', {})),
+            'fingerprints': {int(fingerprint, 16) for fingerprint in stored.get('fingerprints', [])}
+        }
+
+    def _write(self, state):
+        if not self.user_id:
+            self.unsaved_months[state['month']] = state
+            return
+        save_transaction_month(state['month'], {
+            'month': state['month'],
+            'income': round(state['income'], 2),
+            'spending': round(state['spending'], 2),
+            'net': round(state['income'] - state['spending'], 2),
+            'count': state['count'],
+            'by_category': {category: round(total, 2) for category, total in state['by_category'].items()},
+            'fingerprints': [f"{fingerprint:016x}" for fingerprint in sorted(state['fingerprints'])]
+        }, user_id=self.user_id)
+
+    def _month(self, key):
+        state = self.open_months.get(key)
+        if state is None:
+            state = self._load(key)
+            self.open_months[key] = state
+            self.touched_months.add(key)
+            if len(self.open_months) > self.open_months_limit:
+                _, evicted = self.open_months.popitem(last=False)
+                self._write(evicted)
+        else:
+            self.open_months.move_to_end(key)
+        return state
+
+    def add_chunk(self, chunk):
+        """Adds a chunk of transactions to their months. Returns the ones not imported before."""
+        new = []
+        last_month = None
+        ordinals = self.ordinals
+        for txn in chunk:
+            txn_date = txn.date
+            month = (txn_date.year, txn_date.month)
+            if month != last_month:
+                last_month = month
+                state = self._month(f"{month[0]:04d}-{month[1]:02d}")
+                fingerprints = state['fingerprints']
+                by_category = state['by_category']
+
+            if txn.fitid:
+                fingerprint = _fingerprint(txn.fitid)
+            else:
+                basis = f"{txn_date.toordinal()}|{txn.amount!r}|{txn.description}"
+                fingerprint = _fingerprint(basis)
+                ordinal = ordinals.get(fingerprint)
+                if ordinal is None:
+                    ordinals[fingerprint] = 1
+                else:
+                    ordinals[fingerprint] = ordinal + 1
+                    fingerprint = _fingerprint(f"{basis}|{ordinal}")
+            if fingerprint in fingerprints:
+                continue
+            fingerprints.add(fingerprint)
+
+            state['count'] += 1
+            if txn.amount >= 0:
+                state['income'] += txn.amount
+            else:
+                state['spending'] -= txn.amount
+                by_category[txn.category] = by_category.get(txn.category, 0.0) - txn.amount
+            new.append(txn)
+        return new
+
+    def flush(self):
+        for state in self.open_months.values():
+            self._write(state)
+        self.open_months.clear()
+
+class RecurringChargeDetector:
+    """
+    Finds charges of the same amount at the same merchant repeating about
+    monthly, whether the export lists rows oldest or newest first (banks do
+    both). Once the stream is more than a month past
+    either end of a series it cannot grow any more, so it is evaluated and its
+    dates dropped; state is bounded by the number of active merchant/amount pairs.
+    """
+    MIN_MONTHLY_GAPS = 2
+    MIN_GAP_DAYS = 26
+    MAX_GAP_DAYS = 35
+
+    def __init__(self):
+        # (merchant, amount) -> [dates, first_date, last_date, category]
+        self.series = {}
+        # Recurring charges found in series that were pruned
+        self.finished = []
+        self.latest_date = None
+
+    def add(self, txn):
+        if self.latest_date is None or txn.date > self.latest_date:
+            self.latest_date = txn.date
+        if txn.amount >= 0:
+            return
+        key = (txn.merchant, round(-txn.amount, 2))
+        series = self.series.get(key)
+        if series is None:
+            self.series[key] = [{txn.date}, txn.date, txn.date, txn.category]
+            return
+        series[0].add(txn.date)
+        series[1] = min(series[1], txn.date)
+        series[2] = max(series[2], txn.date)
+
+    def _evaluate(self, key, series):
+        """Returns the charge for the monthly run ending at the series' last date, or None."""
+        dates = sorted(series[0], reverse=True)
+        gaps = 0
+        for later, earlier in zip(dates, dates[1:]):
+            if not self.MIN_GAP_DAYS <= (later - earlier).days <= self.MAX_GAP_DAYS:
+                # Irregular spacing ends the run
+                break
+            gaps += 1
+        if gaps < self.MIN_MONTHLY_GAPS:
+            return None
+        merchant, amount = key
+        return {
+            'merchant': merchant,
+            'amount': amount,
+            'category': series[3],
+            'occurrences': gaps + 1,
+            'last_date': dates[0],
+            'annual_cost': round(amount * 12, 2)
+        }
+
+    def prune(self, current_date):
+        stale = [key for key, series in self.series.items()
+                 if (current_date - series[2]).days > self.MAX_GAP_DAYS or (series[1] - current_date).days > self.MAX_GAP_DAYS]
+        for key in stale:
+            charge = self._evaluate(key, self.series.pop(key))
+            if charge is not None:
+                self.finished.append(charge)
+
+    def charges(self):
+        """Returns the recurring charges still active at the end of the stream, costliest first."""
+        latest = {}
+        for charge in self.finished + [self._evaluate(key, series) for key, series in self.series.items()]:
+            if charge is None or (self.latest_date - charge['last_date']).days > self.MAX_GAP_DAYS:
+                continue
+            key = (charge['merchant'], charge['amount'])
+            if key not in latest or charge['last_date'] > latest[key]['last_date']:
+                latest[key] = charge
+        charges = [dict(charge, last_date=charge['last_date'].isoformat()) for charge in latest.values()]
+        charges.sort(key=lambda charge: charge['annual_cost'], reverse=True)
+        return charges
+
+def merge_recurring_charges(stored, detected):
+    """
+    Merges newly detected recurring charges into the stored ones by merchant and
+    amount, keeping the more recent of each, so importing a partial export does
+    not drop charges found by earlier imports.
+    """
+    merged = {(charge['merchant'], charge['amount']): charge for charge in stored}
+    for charge in detected:
+        key = (charge['merchant'], charge['amount'])
+        if key not in merged or charge['last_date'] >= merged[key]['last_date']:
+            merged[key] = charge
+    charges = list(merged.values())
+    charges.sort(key=lambda charge: charge['annual_cost'], reverse=True)
+    return charges
+
+def import_transactions(stream, fmt='csv', user_id=None, chunk_size=CHUNK_SIZE):
+    """
+    Imports a CSV or OFX export from a text stream.
+    Monthly aggregates and recurring charges are saved for `user_id`; with no
+    user_id nothing is read or written and only the summary is returned.
+    """
+    stats = {'rows': 0, 'imported': 0, 'duplicates': 0, 'skipped': 0}
+    parse = parse_ofx if fmt == 'ofx' else parse_csv
+    aggregator = MonthlyAggregator(user_id)
+    detector = RecurringChargeDetector()
+
+    for chunk in normalize(parse(stream, stats, chunk_size)):
+        new = aggregator.add_chunk(chunk)
+        stats['imported'] += len(new)
+        stats['duplicates'] += len(chunk) - len(new)
+        # Recurring charges are detected over the whole export, including rows imported before
+        for txn in chunk:
+            detector.add(txn)
+        detector.prune(chunk[-1].date)
+    aggregator.flush()
+
+    recurring = detector.charges()
+    if user_id:
+        recurring = merge_recurring_charges(get_recurring_charges(user_id=user_id), recurring)
+        save_recurring_charges(recurring, user_id=user_id)
+
+    stats['months'] = sorted(aggregator.touched_months)
+    stats['recurring_charges'] = recurring
+    return stats